@@ -211,6 +211,81 @@
 #     0.7.4: 07/05/2025
 #           Set up the synthesizer after the time-out automatically if it is needed.
 #
+#     0.7.5: 10/17/2026
+#           Vectorized phase modulation kernel for the saw, triangle, square and sampling waves.
+#
+#     0.7.6: 10/17/2026
+#           Closed-form saw, triangle and square wave cycles and the base wave cycle cache.
+#
+#     0.7.7: 10/17/2026
+#           Operator output waves cache (LRU) to reuse operators among phases, algorithms and edits.
+#
+#     0.7.8: 10/17/2026
+#           Regenerate only the FM waves or the additive waves changed after editing a parameter.
+#
+#     0.7.9: 10/17/2026
+#           Sampling waves cache in memory to avoid reading the SD card in every wave generation.
+#
+#     0.8.0: 10/17/2026
+#           Binary sampling wave files (int16) with the wave index file.
+#
+#     0.8.1: 10/17/2026
+#           Operator graph engine for the algorithms, user algorithms in algorithms.json.
+#
+#     0.8.2: 10/17/2026
+#           Generate the wave tables of the seven envelope phases at once as a 2-D (phases x samples) computation.
+#
+#     0.8.3: 10/17/2026
+#           Additive synthesis with an inverse FFT, up to 64 partials in a sound file.
+#
+#     0.8.4: 10/17/2026
+#           Band-limited wave tables for each octave (mipmaps) made at the sound setup to reduce aliasing of high notes.
+#
+#     0.8.5: 10/17/2026
+#           Wave table size (256/512/1024/2048) selectable in each sound file.
+#
+#     0.8.6: 10/17/2026
+#           Wave shapes are regenerated in a background task step by step after editing, MIDI IN is not blocked.
+#
+#     0.8.7: 10/17/2026
+#           The mix of the audio output operator waves and the modulation sample positions are in int16 (fixed point) to save the memory.
+#
+#     0.8.8: 10/17/2026
+#           Scratch buffers, in-place wave math and an allocation benchmark.
+#
+#     0.8.9: 10/17/2026
+#           The envelope phases with the same parameters share a wave table.
+#
+#     0.9.0: 10/17/2026
+#           Key zones with the modulator level scales precomputed.
+#
+#     0.9.1: 10/17/2026
+#           Velocity layers of the wave tables in a memory budget.
+#
+#     0.9.2: 10/17/2026
+#           Analytic band-limited FM synthesis for the sine operator graphs (FM_HARMONICS, off by default).
+#
+#     0.9.3: 10/17/2026
+#           Up to 8 operators, 6 and 8 operators algorithms in algorithms.json.
+#
+#     0.9.4: 10/17/2026
+#           Native ring modulation voices of 2-operator sounds (VOICE_MODE).
+#
+#     0.9.5: 10/17/2026
+#           Note lookup tables of the note frequencies, pitch-bend, glide, key sensitivities and velocity.
+#
+#     0.9.6: 10/17/2026
+#           Voice table with a free list and the voice stealing policies (VOICE_STEAL).
+#
+#     0.9.7: 10/17/2026
+#           Note on with the pooled notes, the envelope cache and the note on filter cache.
+#
+#     0.9.8: 10/17/2026
+#           Envelope phase changes swap the wave table of a note instead of copying it.
+#
+#     0.9.9: 10/17/2026
+#           Envelope phase changes scheduled at the deadlines predicted from the VCA envelope.
+#
 # I2C Unit-1:: DAC PCM1502A
 #   BCK: GP9 (12)
 #   SDA: GP10(14)
@@ -259,6 +334,8 @@
 
 import asyncio
 import time
+import gc
+import math
 import board, busio
 import digitalio
 import sdcardio, storage, os
@@ -271,6 +348,7 @@ import audiodelays
 import ulab.numpy as np		# To generate wave shapes
 import random
 import json
+from collections import OrderedDict
 
 # for SSD1306 OLED Display
 import adafruit_ssd1306
@@ -448,14 +526,27 @@ async def get_8encoder():
             await asyncio.sleep(0.01)
 
 
+##########################################
+# Generate wave shapes in async task
+##########################################
+async def wave_generator():
+    while True:
+        # Generate the wave shapes step by step, MIDI IN works between the steps
+        while SynthIO.wave_job_step():
+            await asyncio.sleep(0.0)
+
+        await asyncio.sleep(0.01)
+
+
 ##########################################
 # Asyncronous functions
 ##########################################
 async def main():
     interrupt_midi_in = asyncio.create_task(midi_in())
     interrupt_get_8encoder = asyncio.create_task(get_8encoder())
+    interrupt_wave_generator = asyncio.create_task(wave_generator())
   
-    await asyncio.gather(interrupt_midi_in, interrupt_get_8encoder)
+    await asyncio.gather(interrupt_midi_in, interrupt_get_8encoder, interrupt_wave_generator)
 
 
 ########################
@@ -526,11 +617,23 @@ class OLED_SSD1306_class:
 ########################
 class ADC_MIC_class:
     SAMPLED_WAVE = np.array([])		# Memory to store sampling data
+    SAMPLE_CACHE_WAVES = 4			# Number of the wave table size sampling waves to cache
+    SAMPLE_CACHE_BYTES = 4096		# Memory size to cache the sampling waves loaded (set by the wave table size)
+    WAVE_PATH  = '/sd/SYNTH/WAVE/'				# Sampling wave files (name.bin: int16 samples)
+    WAVE_INDEX = '/sd/SYNTH/WAVE/index.json'	# Sampling wave names
     
     def __init__(self, adc_pin, adc_name):
         self._adc = AnalogIn(adc_pin)
         self._adc_name = adc_name
 
+        # Sampling waves loaded {name: int16 array}, names in least recently used order
+        self._sample_cache = {}
+        self._sample_cache_names = []
+        self._sample_cache_bytes = 0
+
+        # Sampling wave names in the wave index
+        self._wave_index = None
+
     def adc(self):
         return self._adc
 
@@ -618,37 +721,30 @@ class ADC_MIC_class:
         ADC_MIC_class.SAMPLED_WAVE = np.array(ADC_MIC_class.SAMPLED_WAVE)
 
     # Save sampled wave file
+    #   A wave is saved as a binary file of int16 samples (name.bin) and registered in the wave index.
     def save_samplig_file(self, name, wave=None):
         name = name.strip()
         if len(name) == 0:
             return
         
         try:
-            file_name = '/sd/SYNTH/WAVE/' + name + '.json'
-            with open(file_name, 'w') as f:
-                if wave is None:
-                    wave = ADC_MIC_class.SAMPLED_WAVE
-                    if isinstance(wave, np.ndarray):
-                        wave = wave.tolist()
-                        json.dump(wave, f)
-                        ADC_MIC_class.SAMPLED_WAVE = np.array(wave)
-                        
-                    else:
-                        json.dump(wave, f)
-        
-                else:
-                    if isinstance(wave, np.ndarray):
-                        wave = wave.tolist()
-                        json.dump(wave, f)
+            if wave is None:
+                wave = ADC_MIC_class.SAMPLED_WAVE
 
+            self.write_wave_file(name, wave)
 
-                    else:
-#                        print('wave LIST:', wave)
-                        json.dump(wave, f)
-                    
-                f.close()
+            # Add the wave to the index
+            names = self.find_sampling_files()[1:]
+            if name not in names:
+                names.append(name)
+                self.write_wave_index(names)
                 self.find_sampling_files()
-                success = True
+
+            # Operator waves made with the old wave are obsoleted
+            self.uncache_sampling_wave(name)
+            FM_Waveshape.clear_operator_cache()
+            FM_Waveshape.invalidate_waves(True, False)
+            success = True
 
         except Exception as e:
 #            print('SD SAVE SAMPLE EXCEPTION:', e)
@@ -656,40 +752,141 @@ class ADC_MIC_class:
             
         return success
 
-    # Load sampled wave file
-    def load_sampling_file(self, name):
+    # Write a wave binary file (int16 samples)
+    def write_wave_file(self, name, wave):
+        with open(ADC_MIC_class.WAVE_PATH + name + '.bin', 'wb') as f:
+            f.write(np.array(wave, dtype=np.int16).tobytes())
+            f.close()
+
+    # Read a wave binary file into an int16 array
+    #   The file is read directly into the array memory allocated.
+    def read_wave_file(self, name):
+        file_name = ADC_MIC_class.WAVE_PATH + name + '.bin'
+        buffer = bytearray(os.stat(file_name)[6] // 2 * 2)
+        with open(file_name, 'rb') as f:
+            f.readinto(buffer)
+            f.close()
+
+        return np.frombuffer(buffer, dtype=np.int16)
+
+    # Write the wave index file
+    def write_wave_index(self, names):
+        names.sort()
+        with open(ADC_MIC_class.WAVE_INDEX, 'w') as f:
+            json.dump(names, f)
+            f.close()
+
+        self._wave_index = names
+
+    # Get a sampled wave (int16 array) from the cache, load it from the file if not cached
+    #   Returns None for no name, an empty array for a wave file unavailable.
+    #   Never modify the returned array.
+    def sampling_wave(self, name):
         name = name.strip()
         if len(name) == 0:
             return None
 
+        if name in self._sample_cache:
+            self._sample_cache_names.remove(name)
+            self._sample_cache_names.append(name)
+            return self._sample_cache[name]
+
         try:
-            with open('/sd/SYNTH/WAVE/' + name + '.json', 'r') as f:
-                wave = json.load(f)
-                ADC_MIC_class.SAMPLED_WAVE = wave
-                f.close()
+            wave = self.read_wave_file(name)
 
         except Exception as e:
-#            print('SD LOAD EXCEPTION:', e)
-            ADC_MIC_class.SAMPLED_WAVE = np.array([])
-            return None
+            # Old JSON wave file
+            try:
+                with open(ADC_MIC_class.WAVE_PATH + name + '.json', 'r') as f:
+                    wave = np.array(json.load(f), dtype=np.int16)
+                    f.close()
+
+            except Exception as e:
+#                print('SD LOAD EXCEPTION:', e)
+                wave = np.array([], dtype=np.int16)
+
+        # Remove the least recently used waves to keep the memory size
+        wave_bytes = len(wave) * 2
+        while len(self._sample_cache_names) > 0 and self._sample_cache_bytes + wave_bytes > ADC_MIC_class.SAMPLE_CACHE_BYTES:
+            self.uncache_sampling_wave(self._sample_cache_names[0])
 
+        self._sample_cache[name] = wave
+        self._sample_cache_names.append(name)
+        self._sample_cache_bytes += wave_bytes
         return wave
 
+    # Remove a sampled wave from the cache
+    def uncache_sampling_wave(self, name):
+        name = name.strip()
+        if name in self._sample_cache:
+            self._sample_cache_bytes -= len(self._sample_cache[name]) * 2
+            del self._sample_cache[name]
+            self._sample_cache_names.remove(name)
+
     # Find sampling files
+    #   The wave names come from the wave index file, the index is made at the first time.
     def find_sampling_files(self):
-        # List all file numbers
-        SynthIO_class.VIEW_SAMPLE_WAVES = ['']
+        if self._wave_index is None:
+            try:
+                with open(ADC_MIC_class.WAVE_INDEX, 'r') as f:
+                    self._wave_index = json.load(f)
+                    f.close()
 
-        # Search files
-        finds = 0
-        path_files = os.listdir('/sd/SYNTH/WAVE')
-        for pf in path_files:
-            if pf[-5:] == '.json':
-                SynthIO_class.VIEW_SAMPLE_WAVES.append(pf[:-5])
+            except Exception as e:
+#                print('WAVE INDEX EXCEPTION:', e)
+                try:
+                    self.import_json_waves()
+
+                except Exception as e:
+#                    print('WAVE IMPORT EXCEPTION:', e)
+                    pass
 
-        SynthIO_class.VIEW_SAMPLE_WAVES.sort()
+        # List all wave names (no wave without the index, it is made again at the next time)
+        SynthIO_class.VIEW_SAMPLE_WAVES = [''] + (self._wave_index if self._wave_index is not None else [])
         return SynthIO_class.VIEW_SAMPLE_WAVES
 
+    # Import the JSON wave files (name.json) into the binary wave files and make the wave index
+    def import_json_waves(self):
+        names = []
+        for pf in os.listdir(ADC_MIC_class.WAVE_PATH[:-1]):
+            # Binary wave file
+            if pf[-4:] == '.bin':
+                if pf[:-4] not in names:
+                    names.append(pf[:-4])
+
+            # JSON wave file
+            elif pf[-5:] == '.json' and ADC_MIC_class.WAVE_PATH + pf != ADC_MIC_class.WAVE_INDEX:
+                try:
+                    with open(ADC_MIC_class.WAVE_PATH + pf, 'r') as f:
+                        wave = json.load(f)
+                        f.close()
+
+                    self.write_wave_file(pf[:-5], wave)
+                    if pf[:-5] not in names:
+                        names.append(pf[:-5])
+
+                except Exception as e:
+#                    print('WAVE IMPORT EXCEPTION:', pf, e)
+                    pass
+
+        self.write_wave_index(names)
+        return self._wave_index
+
+    # Export a binary wave file to a JSON wave file (name.json)
+    def export_json_wave(self, name):
+        name = name.strip()
+        try:
+            wave = self.read_wave_file(name)
+            with open(ADC_MIC_class.WAVE_PATH + name + '.json', 'w') as f:
+                json.dump(wave.tolist(), f)
+                f.close()
+
+        except Exception as e:
+#            print('WAVE EXPORT EXCEPTION:', name, e)
+            return False
+
+        return True
+
 ################# End of ADC MIC Class Definition #################
 
 
@@ -857,12 +1054,159 @@ class Ticks:
 ################# End of Thicks Class Definition #################
 
 
+###################################
+# CLASS: Note lookup tables
+###################################
+class NoteTable_class:
+    # Number of the note frequencies (the highest note + the maximum pitch-bend range)
+    NOTE_MAX = 128 + 12
+
+    # Glide curve resolution (entries in a semitone)
+    GLIDE_RESOLUTION = 128
+
+    def __init__(self):
+        # Note frequencies
+        self._note_hz = []
+        for note in list(range(NoteTable_class.NOTE_MAX)):
+            self._note_hz.append(synthio.midi_to_hz(note))
+
+        # Glide curves: the geometric progression in semitones and in fractions of a semitone
+        self._glide_semitone = []
+        for semitone in list(range(NoteTable_class.NOTE_MAX)):
+            self._glide_semitone.append(MIDI_class.GEOMETRIC_PROG ** semitone)
+
+        self._glide_fraction = []
+        for fraction in list(range(NoteTable_class.GLIDE_RESOLUTION)):
+            self._glide_fraction.append(MIDI_class.GEOMETRIC_PROG ** (fraction / NoteTable_class.GLIDE_RESOLUTION))
+
+        # Velocity curve
+        self._velocity = []
+        for velocity in list(range(128)):
+            self._velocity.append(velocity / 127.0)
+
+        # Key sensitivity magnitudes of the VCA and the filter (made for the current key sensitivity)
+        self._vca_keysense = None
+        self._vca_keysense_table = [1.0] * 128
+        self._filter_keysense = None
+        self._filter_keysense_table = [1.0] * 128
+
+    # Get a note frequency
+    def note_hz(self, note):
+        return self._note_hz[note]
+
+    # Get a pitch-bend range in heltz of a note
+    def bend_hz(self, note, bend):
+        return self._note_hz[note + bend] - self._note_hz[note]
+
+    # Get a glide ratio, the geometric progression to the power of semitones
+    def glide(self, semitones):
+        steps = int(abs(semitones) * NoteTable_class.GLIDE_RESOLUTION)
+        semitone = steps // NoteTable_class.GLIDE_RESOLUTION
+        if semitone >= NoteTable_class.NOTE_MAX:
+            semitone = NoteTable_class.NOTE_MAX - 1
+
+        ratio = self._glide_semitone[semitone] * self._glide_fraction[steps % NoteTable_class.GLIDE_RESOLUTION]
+        return ratio if semitones >= 0 else 1.0 / ratio
+
+    # Get a velocity magnitude (0.0..1.0)
+    def velocity(self, velocity):
+        return self._velocity[velocity]
+
+    # Get a VCA key sensitivity magnitude of a note
+    def vca_keysense(self, keysense, note):
+        if keysense != self._vca_keysense:
+            self._vca_keysense = keysense
+            for nt in list(range(128)):
+                magni = keysense * (nt - (0 if keysense > 0 else 128)) / 850
+                if magni < 0.1:
+                    magni = 0.1
+                elif magni > 0.9:
+                    magni = 1.0
+
+                self._vca_keysense_table[nt] = magni if keysense != 0 else 1.0
+
+        return self._vca_keysense_table[note]
+
+    # Get a filter key sensitivity magnitude of a note
+    def filter_keysense(self, keysense, note):
+        if keysense != self._filter_keysense:
+            self._filter_keysense = keysense
+            for nt in list(range(128)):
+                if keysense == 0:
+                    magni = 1.0
+                    
+                elif keysense > 0:  # 0.1 --- 1.0
+                    magni = 1.0 - keysense * (128 - nt) / 1280
+                    
+                else:               # 1.0 --- 0.1
+                    magni = 1.0 + keysense * nt / 1280
+
+                self._filter_keysense_table[nt] = magni
+
+        return self._filter_keysense_table[note]
+
+################# End of Note Table Class Definition #################
+
+
+###################################
+# CLASS: Voice of MIDI_class
+###################################
+class Voice_class:
+    __slots__ = (
+        'number',		# Voice number (= filter number)
+        'key',			# Key in the voice table (note number + 128 for the unison voice, -1: no key)
+        'note',			# MIDI note number
+        'velocity',		# Note on velocity
+        'age',			# Note on sequence number
+        'released',		# True: released and playing the release phase
+        'synth_note',	# synthio Note (None: vacant voice)
+        'ring_note',	# synthio Note for the ring modulation voice (None: not used)
+        'pool_note',	# synthio Note reused in the next note on
+        'pool_ring_note',	# synthio Note for the ring modulation voice reused in the next note on
+        'pitch',		# [Original note heltz, Pitch-bend to, Potament from, Portament Ratio, Portament Direction (1: up, -1: down), Portament Progression Duration]
+        'wave',			# Wave shape phase playing
+        'table',		# Wave table playing
+        'start',		# Note on ticks
+        'phase_times',	# Times to change the wave shape phase 1..6 from the note on in msec
+        'deadline',		# Ticks to change the wave shape phase (or to check the end of the release phase)
+        'heap_index'	# Index in the deadline heap (-1: not scheduled)
+    )
+
+    def __init__(self, number):
+        self.number = number
+        self.key = -1
+        self.note = 0
+        self.velocity = 0
+        self.age = 0
+        self.released = False
+        self.synth_note = None
+        self.ring_note = None
+        self.pool_note = None
+        self.pool_ring_note = None
+        self.pitch = [0.0, 0.0, 0.0, 0.0, 1, 0.0]
+        self.wave = 0
+        self.table = None
+        self.start = 0
+        self.phase_times = None
+        self.deadline = 0
+        self.heap_index = -1
+
+################# End of Voice Class Definition #################
+
+
 ###################################
 # CLASS: USB MIDI
 ###################################
 class MIDI_class:
     # The geometoric progression ration between notes next to ach other
     GEOMETRIC_PROG = 1.059463094
+
+    # Envelope cache: quantize steps of the attack and sustain levels, max envelopes cached
+    ENVELOPE_LEVEL_STEPS = 64
+    ENVELOPE_CACHE_MAX = 64
+
+    # Interval to check the end of the release phase after the release time in msec
+    RELEASE_CHECK_MS = 50
     
     # Constructor
     #   USB MIDI
@@ -887,11 +1231,20 @@ class MIDI_class:
             print('USB:device')
 
         # For receiving and treating MIDI events
-        self.notes = {}						# {note number: Note object}
-        self.notes_phase = {}				# {note number: Note envelope phase}
-        self.notes_pitch = {}				# {note number: [Original note heltz, Pitch-bend to, Potament from, Portament Ratio, Portament Progression Ratio, Portament Progression Duration]}
-        self.filters = {}					# {note number: filter number=voice}
-        self.notes_stack = []				# [note1, note2,...]  contains only notes playing.
+        self._voices = []					# Voice table
+        for v in list(range(SynthIO_class.MAX_VOICES)):
+            self._voices.append(Voice_class(v))
+
+        self._voice_free = list(range(SynthIO_class.MAX_VOICES - 1, -1, -1))	# Free voice numbers (stack)
+        self._voice_keys = [None] * 256		# Voice playing for each key (note number, note number + 128 for the unison voice)
+        self._voice_age  = 0				# Note on sequence number
+        self._envelopes  = {}				# Envelope cache {quantized attack level * (ENVELOPE_LEVEL_STEPS + 1) + quantized sustain level: synthio.Envelope}
+        self._envelope_times = [None, None, None]	# VCA attack, decay and release times of the envelope cache
+        self._phase_times = [0, 0, 0, 0, 0, 0]	# Times to change the wave shape phase 1..6 from the note on in msec (along the VCA times)
+        self._deadlines = [None] * SynthIO_class.MAX_VOICES	# Min-heap of the voices by the deadline
+        self._deadlines_size = 0
+        self.wave_switches = 0				# Counter of the envelope phase changes
+        self.wave_swaps    = 0				# Counter of the wave table swaps in the envelope phase changes
         self.latest_note_hz = None			# The latest noted playing
         self.synthIO = synthesizer
         self.synthesizer = synthesizer.synth()
@@ -963,10 +1316,219 @@ class MIDI_class:
         print('TURN ON WITH USB MIDI HOST MODE.')
         return self._usb_midi_host
         
-    # Set shifted frequency to a note in the pitch-bend or the portament 
-    def frequency_shift(self, note_num, start_freq, move_freq, ratio):
+    # Set shifted frequency to a voice in the pitch-bend or the portament 
+    def frequency_shift(self, voice, start_freq, move_freq, ratio):
         pitch = int(move_freq * ratio)
-        self.notes[note_num].frequency = start_freq + pitch
+        voice.synth_note.frequency = start_freq + pitch
+        if voice.ring_note is not None:
+            voice.ring_note.frequency = start_freq + pitch
+            voice.ring_note.ring_frequency = (start_freq + pitch) * SynthIO.ring_voice()['ratio']
+
+    # Get an envelope of the VCA times and the quantized levels (cached)
+    def envelope(self, vca, attack_level, sustain_level):
+        # Clear the cache when the VCA times have been changed or the cache is full
+        times = self._envelope_times
+        if times[0] != vca['ATTACK'] or times[1] != vca['DECAY'] or times[2] != vca['RELEASE']:
+            times[0] = vca['ATTACK']
+            times[1] = vca['DECAY']
+            times[2] = vca['RELEASE']
+            self._envelopes = {}
+
+            # The wave shape phases change at 1/3 and 2/3 of the attack and the decay (the levels change linearly),
+            # then at the start of the decay and the sustain.
+            attack = int(vca['ATTACK'] * 1000)
+            decay  = int(vca['DECAY'] * 1000)
+            self._phase_times = [attack // 3, attack * 2 // 3, attack, attack + decay // 3, attack + decay * 2 // 3, attack + decay]
+
+        elif len(self._envelopes) >= MIDI_class.ENVELOPE_CACHE_MAX:
+            self._envelopes = {}
+
+        attack_step  = int(attack_level  * MIDI_class.ENVELOPE_LEVEL_STEPS + 0.5)
+        sustain_step = int(sustain_level * MIDI_class.ENVELOPE_LEVEL_STEPS + 0.5)
+        key = attack_step * (MIDI_class.ENVELOPE_LEVEL_STEPS + 1) + sustain_step
+        env = self._envelopes.get(key)
+        if env is None:
+            env = synthio.Envelope(
+                attack_time=vca['ATTACK'],
+                decay_time=vca['DECAY'],
+                release_time=vca['RELEASE'],
+                attack_level=attack_step / MIDI_class.ENVELOPE_LEVEL_STEPS,
+                sustain_level=sustain_step / MIDI_class.ENVELOPE_LEVEL_STEPS
+            )
+            self._envelopes[key] = env
+
+        return env
+
+    # Get a pooled note of a voice to reuse, or None if the note is still sounding
+    def pooled_note(self, note):
+        if note is None:
+            return None
+
+        if self.synthesizer.note_info(note)[0] is not None:
+            return None
+
+        return note
+
+    # Schedule a deadline of a voice in the deadline heap
+    def schedule(self, voice, deadline):
+        if voice.heap_index >= 0:
+            self.unschedule(voice)
+
+        voice.deadline = deadline
+        voice.heap_index = self._deadlines_size
+        self._deadlines[self._deadlines_size] = voice
+        self._deadlines_size += 1
+        self.sift_deadline(voice.heap_index)
+
+    # Remove a voice from the deadline heap
+    def unschedule(self, voice):
+        index = voice.heap_index
+        if index < 0:
+            return
+
+        self._deadlines_size -= 1
+        last = self._deadlines[self._deadlines_size]
+        self._deadlines[self._deadlines_size] = None
+        voice.heap_index = -1
+        if last is not voice:
+            self._deadlines[index] = last
+            last.heap_index = index
+            self.sift_deadline(index)
+
+    # Move a voice in the deadline heap up or down to the place along its deadline
+    def sift_deadline(self, index):
+        heap = self._deadlines
+        voice = heap[index]
+
+        # Up
+        while index > 0:
+            parent = (index - 1) // 2
+            if Ticks.diff(voice.deadline, heap[parent].deadline) >= 0:
+                break
+
+            heap[index] = heap[parent]
+            heap[index].heap_index = index
+            index = parent
+
+        # Down
+        while True:
+            child = index * 2 + 1
+            if child >= self._deadlines_size:
+                break
+
+            if child + 1 < self._deadlines_size and Ticks.diff(heap[child + 1].deadline, heap[child].deadline) < 0:
+                child += 1
+
+            if Ticks.diff(heap[child].deadline, voice.deadline) >= 0:
+                break
+
+            heap[index] = heap[child]
+            heap[index].heap_index = index
+            index = child
+
+        heap[index] = voice
+        voice.heap_index = index
+
+    # Get the voice playing a key (None: no voice)
+    def voice(self, note, unison=False):
+        return self._voice_keys[note + (128 if unison else 0)]
+
+    # Number of voices playable
+    #   A ring modulation voice plays 2 synthio notes, so the half of the voices are playable.
+    def voice_max(self):
+        ring_voice = SynthIO.ring_voice()
+        if ring_voice is not None and ring_voice['modulator'] is not None:
+            return SynthIO_class.MAX_VOICES // 2
+
+        return SynthIO_class.MAX_VOICES
+
+    # Allocate a voice for a key, steal a voice if no voice is playable
+    def voice_on(self, note, unison=False):
+        voice_max = self.voice_max()
+        while SynthIO_class.MAX_VOICES - len(self._voice_free) >= voice_max:
+            self.voice_free(self.voice_steal())
+
+        voice = self._voices[self._voice_free.pop()]
+        voice.key = note + (128 if unison else 0)
+        voice.note = note
+        voice.released = False
+        voice.age = self._voice_age
+        self._voice_age += 1
+        self._voice_keys[voice.key] = voice
+        return voice
+
+    # Choose a voice to steal along the stealing policy
+    def voice_steal(self):
+        policy = SynthIO._synth_params['SOUND']['VOICE_STEAL']
+        steal = None
+        level = 2.0
+        for voice in self._voices:
+            # Vacant voice
+            if voice.synth_note is None:
+                continue
+
+            # The lowest envelope level
+            if policy == SynthIO_class.STEAL_QUIETEST:
+                env = self.synthesizer.note_info(voice.synth_note)
+                env_level = 0.0 if env[0] is None else env[1]
+                if env_level < level:
+                    steal = voice
+                    level = env_level
+
+            # The oldest voice (the smallest age, held or released)
+            elif policy == SynthIO_class.STEAL_OLDEST:
+                if steal is None or voice.age < steal.age:
+                    steal = voice
+
+            # Released voices first (a held note is never stolen while a released voice is playing)
+            elif steal is None or voice.released and not steal.released:
+                steal = voice
+                if voice.released:
+                    env = self.synthesizer.note_info(voice.synth_note)
+                    level = 0.0 if env[0] is None else env[1]
+
+            elif voice.released == steal.released:
+                # The quietest released voice
+                if voice.released:
+                    env = self.synthesizer.note_info(voice.synth_note)
+                    env_level = 0.0 if env[0] is None else env[1]
+                    if env_level < level:
+                        steal = voice
+                        level = env_level
+
+                # The oldest voice
+                elif voice.age < steal.age:
+                    steal = voice
+
+#        print('STEAL VOICE:', policy, steal.number, steal.note, steal.released)
+        return steal
+
+    # Release a voice, the voice plays the release phase until the envelope ends
+    def voice_release(self, voice):
+        if voice.released:
+            return
+
+        self.synthesizer.release(voice.synth_note)
+        if voice.ring_note is not None:
+            self.synthesizer.release(voice.ring_note)
+
+        self.synthIO.filter_release(voice.number)
+        self._voice_keys[voice.key] = None
+        voice.key = -1
+        voice.released = True
+
+        # Check the end of the release phase after the release time
+        self.schedule(voice, Ticks.add(Ticks.ms(), int(self._envelope_times[2] * 1000) + MIDI_class.RELEASE_CHECK_MS))
+
+    # Free a voice
+    def voice_free(self, voice):
+        self.voice_release(voice)
+        self.unschedule(voice)
+        voice.synth_note = None
+        voice.ring_note = None
+        voice.table = None
+        voice.released = False
+        self._voice_free.append(voice.number)
 
     # MIDI-IN via a port of the current mode
     def midi_in(self):            
@@ -996,33 +1558,34 @@ class MIDI_class:
                         if portament_diff > 0:
                             portament_ms = now
 #                            print('PORTAMENT DIFF:', portament_diff, SynthIO._synth_params['SOUND']['PORTAMENT'], portament_diff / SynthIO._synth_params['SOUND']['PORTAMENT'])
-                            for midi_note_number in self.notes.keys():
-                                if self.notes[midi_note_number] is not None:
+                            for voice in self._voices:
+                                if voice.synth_note is not None and not voice.released:
                                     # Portament
-                                    if self.notes_pitch[midi_note_number][0] != self.notes_pitch[midi_note_number][2] and self.notes_pitch[midi_note_number][3] < 1.0:
+                                    pitch = voice.pitch
+                                    if pitch[0] != pitch[2] and pitch[3] < 1.0:
                                         
                                         # Constant frequency mode
                                         if portament_steps < 0:
-#                                            print('PORTAMENT C:', self.notes[midi_note_number].frequency, self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][2], self.notes_pitch[midi_note_number][3])
-#                                            print('PORT PROG RATIO-0:', portament_diff, self.notes_pitch[midi_note_number][2], self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][3], self.notes_pitch[midi_note_number][4])
-                                            portament_heltz = self.notes_pitch[midi_note_number][2] * (self.notes_pitch[midi_note_number][4] ** (-self.notes_pitch[midi_note_number][5] / portament_steps))
-                                            self.notes_pitch[midi_note_number][3] = (portament_heltz - self.notes_pitch[midi_note_number][2]) / (self.notes_pitch[midi_note_number][0] - self.notes_pitch[midi_note_number][2])
-#                                            print('PORT PROG RATIO-1:', portament_heltz, self.notes_pitch[midi_note_number][3], self.notes_pitch[midi_note_number][4])
+#                                            print('PORTAMENT C:', voice.synth_note.frequency, pitch[0], pitch[2], pitch[3])
+#                                            print('PORT PROG RATIO-0:', portament_diff, pitch[2], pitch[0], pitch[3], pitch[4])
+                                            portament_heltz = pitch[2] * NoteTable.glide(pitch[4] * -pitch[5] / portament_steps)
+                                            pitch[3] = (portament_heltz - pitch[2]) / (pitch[0] - pitch[2])
+#                                            print('PORT PROG RATIO-1:', portament_heltz, pitch[3], pitch[4])
                                             
                                         # Constant time mode
                                         else:
-                                            current_notes = (self.notes_pitch[midi_note_number][5] / portament_steps) * abs((self.notes_pitch[midi_note_number][0] - self.notes_pitch[midi_note_number][2]))
-                                            portament_heltz = self.notes_pitch[midi_note_number][2] * (self.notes_pitch[midi_note_number][4] ** current_notes)
-                                            self.notes_pitch[midi_note_number][3] = (portament_heltz - self.notes_pitch[midi_note_number][2]) / (self.notes_pitch[midi_note_number][0] - self.notes_pitch[midi_note_number][2])
+                                            current_notes = (pitch[5] / portament_steps) * abs((pitch[0] - pitch[2]))
+                                            portament_heltz = pitch[2] * NoteTable.glide(pitch[4] * current_notes)
+                                            pitch[3] = (portament_heltz - pitch[2]) / (pitch[0] - pitch[2])
                                         
                                         # Adjust portament ratio
-                                        self.notes_pitch[midi_note_number][5] += portament_diff
-                                        if self.notes_pitch[midi_note_number][3] > 1.0:
-                                            self.notes_pitch[midi_note_number][3] = 1.0
+                                        pitch[5] += portament_diff
+                                        if pitch[3] > 1.0:
+                                            pitch[3] = 1.0
                                             
                                         # Portament frequency shift
-                                        self.frequency_shift(midi_note_number, self.notes_pitch[midi_note_number][2], self.notes_pitch[midi_note_number][0] - self.notes_pitch[midi_note_number][2], self.notes_pitch[midi_note_number][3])
-#                                        print('PORTAMENT S:', self.notes[midi_note_number].frequency, self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][2], self.notes_pitch[midi_note_number][3])
+                                        self.frequency_shift(voice, pitch[2], pitch[0] - pitch[2], pitch[3])
+#                                        print('PORTAMENT S:', voice.synth_note.frequency, pitch[0], pitch[2], pitch[3])
 
                     # Back to the edit mode after invalid midi events has come for a while
                     if Application.EDITOR_MODE == False and Ticks.diff(now, self.latest_midi_in) > SynthIO._synth_params['EFFECTOR']['PAUSE_SEC'] * 1000:
@@ -1068,39 +1631,20 @@ class MIDI_class:
 
                     # Note On
                     if isinstance(midi_msg, NoteOn) and midi_msg.velocity > 0:
-                        # MIDI note number with the unison heltz (offset 1000)
-                        midi_note_number = midi_msg.note + (0 if unison_hz == 0 else 1000)
-                        
-                        # The note is playing: stop the current note, then play new note
-#                        print('NOTE ON :', midi_msg.note, midi_msg.velocity, unison_hz, midi_note_number)
-                        if midi_note_number in self.notes:
-                            if self.notes[midi_note_number] is not None:
-#                                print('REUSE NOTE:', midi_note_number)
-                                self.synthesizer.release(self.notes[midi_note_number])
-                                self.notes_stack.remove(midi_note_number)
-                                if midi_note_number in self.filters:
-                                    self.synthIO.filter_release(self.filters[midi_note_number])
-                                    del self.filters[midi_note_number]
-
-                        # New note
-                        elif len(self.notes_stack) == SynthIO_class.MAX_VOICES:
-                            # Stop the oldest note if over max voices
-                            stop_note = self.notes_stack.pop()
-#                            print('STOP THE OLDEST NOTE:', stop_note, self.notes[stop_note])
-                            if self.notes[stop_note] is not None:
-                                self.synthesizer.release(self.notes[stop_note])
-                                del self.notes[stop_note]
-                                self.synthIO.filter_release(self.filters[stop_note])
-                                del self.filters[stop_note]
-                            
-#                        else:
-#                            print('NEW NOTE:', midi_note_number)
+                        # The note is playing: release the current voice, then play a new voice
+#                        print('NOTE ON :', midi_msg.note, midi_msg.velocity, unison_hz)
+                        voice = self.voice(midi_msg.note, unison_hz != 0)
+                        if voice is not None:
+#                            print('REUSE NOTE:', midi_msg.note)
+                            self.voice_release(voice)
+
+                        # Allocate a voice (the oldest, the quietest or a released voice is stolen if over max voices)
+                        voice = self.voice_on(midi_msg.note, unison_hz != 0)
+                        voice.velocity = midi_msg.velocity
 
-                        # Generate a filter for the note, then store the filter number
-                        self.filters[midi_note_number] = SynthIO.filter(None, midi_msg.velocity, midi_note_number)
-#                        print('NOTE FILTER:', self.filters[midi_msg.note], self.synthIO.filter(self.filters[midi_note_number]))
-#                        print('FILTERS NEW:', midi_note_number, self.filters)
-                        init_filter = self.synthIO.filter(self.filters[midi_note_number])['FILTER']
+                        # Start the filter of the voice
+                        init_filter = self.synthIO.filter_start(voice.number, midi_msg.velocity, midi_msg.note)['FILTER']
+#                        print('NOTE FILTER:', voice.number, self.synthIO.filter(voice.number))
 
                         # Calculate the VCA ADSR volume
                         attack_level  = vca['ATTACK_LEVEL']
@@ -1108,19 +1652,15 @@ class MIDI_class:
                             
                         # VCA key senesitivity
                         if vca['KEYSENSE'] != 0:
-                            magni = vca['KEYSENSE'] * (midi_msg.note - (0 if vca['KEYSENSE'] > 0 else 128)) / 850
-                            if magni < 0.1:
-                                magni = 0.1
-                            elif magni > 0.9:
-                                magni = 1.0
-                                
+                            magni = NoteTable.vca_keysense(vca['KEYSENSE'], midi_msg.note)
                             attack_level  *= magni
                             sustain_level *= magni
 #                            print('MAGNI=', midi_msg.note, vca['KEYSENSE'], magni)
 
                         # Note on velocity with the key sensitivity
-                        attack_level  = (midi_msg.velocity * attack_level) / 127.0
-                        sustain_level = (midi_msg.velocity * sustain_level) / 127.0
+                        velocity = NoteTable.velocity(midi_msg.velocity)
+                        attack_level  *= velocity
+                        sustain_level *= velocity
 #                        print('AS:', midi_msg.velocity, attack_level, sustain_level)
 
                         # Adjust VCA ADSR ranges
@@ -1134,117 +1674,153 @@ class MIDI_class:
                         elif sustain_level < 0.0:
                             sustain_level = 0.0
 
-                        # Generate an ADSR for the note
-                        note_env = synthio.Envelope(
-                                        attack_time=vca['ATTACK'],
-                                        decay_time=vca['DECAY'],
-                                        release_time=vca['RELEASE'],
-                                        attack_level=attack_level,
-                                        sustain_level=sustain_level
-                                    )
-
-                        # Copy the wave shape to a note waveform as python list slice
-                        wave_shape = np.zeros(FM_Waveshape_class.SAMPLE_SIZE, dtype=np.int16)
-                        
+                        # Get an ADSR for the note (the levels are quantized)
+                        note_env = self.envelope(vca, attack_level, sustain_level)
+                        attack_level  = note_env.attack_level
+                        sustain_level = note_env.sustain_level
+
                         # Note related frequencies 
-                        original_hz = synthio.midi_to_hz(midi_msg.note)
+                        original_hz = NoteTable.note_hz(midi_msg.note)
                         note_hz =  original_hz + unison_hz
                         
                         if self.latest_note_hz is None:
                             self.latest_note_hz = note_hz
                             
-                        # Note information [Original note heltz, Pitch-bend to, Potament from, Portament Ratio, Portament Progression Ratio, Portament Progression Duration]
-                        self.notes_pitch[midi_note_number] = [
-                            note_hz,
-                            synthio.midi_to_hz(midi_msg.note + SynthIO._synth_params['SOUND']['PITCH_BEND']) - original_hz,
-                            note_hz if SynthIO._synth_params['SOUND']['PORTAMENT'] == 0.0 else self.latest_note_hz,
-                            1.0 if SynthIO._synth_params['SOUND']['PORTAMENT'] == 0.0 else 0.0,
-                            MIDI_class.GEOMETRIC_PROG if note_hz >= self.latest_note_hz else 1.0 / MIDI_class.GEOMETRIC_PROG,
-                            0.0
-                        ]
+                        # Note information [Original note heltz, Pitch-bend to, Potament from, Portament Ratio, Portament Direction (1: up, -1: down), Portament Progression Duration]
+                        pitch = voice.pitch
+                        pitch[0] = note_hz
+                        pitch[1] = NoteTable.bend_hz(midi_msg.note, SynthIO._synth_params['SOUND']['PITCH_BEND'])
+                        pitch[2] = note_hz if SynthIO._synth_params['SOUND']['PORTAMENT'] == 0.0 else self.latest_note_hz
+                        pitch[3] = 1.0 if SynthIO._synth_params['SOUND']['PORTAMENT'] == 0.0 else 0.0
+                        pitch[4] = 1 if note_hz >= self.latest_note_hz else -1
+                        pitch[5] = 0.0
                         
                         # Portament starting note heltz
                         if unison_heltz == 0 or unison_hz != 0:
                             self.latest_note_hz = note_hz
 #                            print('PORTAMENT START HZ:', self.latest_note_hz)
 
-                        # Generate a note to play
-#                        print('PLAY NOTE:', midi_note_number, self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][2])
-                        self.notes[midi_note_number] = synthio.Note(
-                            frequency=self.notes_pitch[midi_note_number][2],
-                            filter=init_filter,
-                            envelope=note_env,
-                            waveform=wave_shape
-                        )
-                        
-                        # Copy the wave shape data to the note
-                        self.notes[midi_note_number].waveform[:] = SynthIO.wave_shape(0)
+                        # Reuse the note of the voice, or generate a note to play
+                        #   The note waveform is the wave table itself (in the velocity layer), the wave tables are read-only.
+#                        print('PLAY NOTE:', voice.number, midi_msg.note, pitch[0], pitch[2])
+                        wave_table = SynthIO.wave_shape(0, note=midi_msg.note, velocity=midi_msg.velocity)
+                        note = self.pooled_note(voice.pool_note)
+                        if note is None:
+                            note = synthio.Note(
+                                frequency=pitch[2],
+                                filter=init_filter,
+                                envelope=note_env,
+                                waveform=wave_table
+                            )
+                            voice.pool_note = note
+
+                        else:
+                            note.frequency = pitch[2]
+                            note.filter = init_filter
+                            note.envelope = note_env
+                            note.waveform = wave_table
+                            note.amplitude = 1.0
+                            note.bend = 0.0
+
+                        voice.synth_note = note
                         
-                        # Wave shape switch status
-                        self.notes_phase[midi_note_number] = {'wave': 0, 'envelope': None, 'attack1': attack_level / 3, 'attack2': attack_level / 3 * 2, 'decay1': (attack_level - sustain_level) / 3 * 2 + sustain_level, 'decay2': (attack_level - sustain_level) / 3 + sustain_level}
+                        # Wave shape switch status, the first phase change is scheduled
+                        voice.wave = 0
+                        voice.table = wave_table
+                        voice.start = Ticks.ms()
+                        voice.phase_times = self._phase_times
+                        self.schedule(voice, Ticks.add(voice.start, voice.phase_times[0]))
 
                         # Tremolo
                         if self.synthIO.lfo_sound_amplitude() is not None:
-                            self.notes[midi_note_number].amplitude=self.synthIO.lfo_sound_amplitude()
+                            voice.synth_note.amplitude=self.synthIO.lfo_sound_amplitude()
                         
                         # Vibrate
                         if self.synthIO.lfo_sound_bend() is not None:
-                            self.notes[midi_note_number].bend=self.synthIO.lfo_sound_bend()
+                            voice.synth_note.bend=self.synthIO.lfo_sound_bend()
+
+                        # Ring modulation note along the modulator envelope (the wave table is shared)
+                        ring_voice = SynthIO.ring_voice()
+                        if ring_voice is not None and ring_voice['modulator'] is not None:
+                            ring_env = self.envelope(vca, attack_level * ring_voice['attack'], sustain_level * ring_voice['sustain'])
+                            note = self.pooled_note(voice.pool_ring_note)
+                            if note is None:
+                                note = synthio.Note(
+                                    frequency=pitch[2],
+                                    filter=init_filter,
+                                    envelope=ring_env,
+                                    waveform=wave_table,
+                                    ring_frequency=pitch[2] * ring_voice['ratio'],
+                                    ring_waveform=ring_voice['modulator']
+                                )
+                                voice.pool_ring_note = note
+
+                            else:
+                                note.frequency = pitch[2]
+                                note.filter = init_filter
+                                note.envelope = ring_env
+                                note.waveform = wave_table
+                                note.ring_frequency = pitch[2] * ring_voice['ratio']
+                                note.ring_waveform = ring_voice['modulator']
+                                note.amplitude = 1.0
+                                note.bend = 0.0
+                                note.ring_bend = 0.0
+
+                            voice.ring_note = note
+
+                            if self.synthIO.lfo_sound_amplitude() is not None:
+                                voice.ring_note.amplitude=self.synthIO.lfo_sound_amplitude()
+                        
+                            if self.synthIO.lfo_sound_bend() is not None:
+                                voice.ring_note.bend=self.synthIO.lfo_sound_bend()
+                                voice.ring_note.ring_bend=self.synthIO.lfo_sound_bend()
 
                         # Play the note
-                        self.synthesizer.press(self.notes[midi_note_number])
-                        self.notes_stack.insert(0, midi_note_number)
+                        self.synthesizer.press(voice.synth_note)
+                        if voice.ring_note is not None:
+                            self.synthesizer.press(voice.ring_note)
 
                     # Note Off
                     else:
                         # Back to the play mode
                         Application_class.editor_mode(False)
                         
-                        # MIDI note number with the unison heltz (offset 1000)
-                        midi_note_number = midi_msg.note + (0 if unison_hz == 0 else 1000)
-
-#                        print('NOTE OFF:', midi_msg.note, midi_note_number)
-                        if midi_note_number in self.notes:
-                            if self.notes[midi_note_number] is not None:
-                                self.synthesizer.release(self.notes[midi_note_number])
-                                del self.notes[midi_note_number]
-                                del self.notes_phase[midi_note_number]
-                                del self.notes_pitch[midi_note_number]
-                                self.notes_stack.remove(midi_note_number)
-#                                print('STACK:', midi_note_number, len(self.notes_stack))
-                                self.synthIO.filter_release(self.filters[midi_note_number])
-                                del self.filters[midi_note_number]
-#                                print('FILTERS OFF:', midi_note_number, self.filters)
-
-#                        print('===NOTES :', self.notes)
-#                        print('===VOICES:', self.notes_stack)
+#                        print('NOTE OFF:', midi_msg.note, unison_hz)
+                        voice = self.voice(midi_msg.note, unison_hz != 0)
+                        if voice is not None:
+                            self.voice_release(voice)
 
                 # ControlChange (modulation)
                 elif isinstance(midi_msg, ControlChange):
 #                    print('CONTROL CHANGE:', midi_msg)
                     cc_mode = self.synthIO.generate_sound_lfo(midi_msg)
                     if cc_mode != 0:
-                        for midi_note_number in self.notes.keys():
-                            if self.notes[midi_note_number] is not None:
-#                                print('MODULATION:', midi_note_number, cc_mode)
+                        for voice in self._voices:
+                            if voice.synth_note is not None and not voice.released:
+#                                print('MODULATION:', voice.number, cc_mode)
                                 if cc_mode & 0x01:
                                     if self.synthIO.lfo_sound_amplitude() is not None:
-                                        self.notes[midi_note_number].amplitude = self.synthIO.lfo_sound_amplitude()
+                                        voice.synth_note.amplitude = self.synthIO.lfo_sound_amplitude()
+                                        if voice.ring_note is not None:
+                                            voice.ring_note.amplitude = self.synthIO.lfo_sound_amplitude()
                                     
                                 if cc_mode & 0x02:
                                     if self.synthIO.lfo_sound_bend() is not None:
-                                        self.notes[midi_note_number].bend = self.synthIO.lfo_sound_bend()
+                                        voice.synth_note.bend = self.synthIO.lfo_sound_bend()
+                                        if voice.ring_note is not None:
+                                            voice.ring_note.bend = self.synthIO.lfo_sound_bend()
+                                            voice.ring_note.ring_bend = self.synthIO.lfo_sound_bend()
 
                 # Pitch bend
                 elif isinstance(midi_msg, PitchBend):
                     Application_class.editor_mode(False)
 
 #                    print('PITCH BEND:', midi_msg)
-                    for midi_note_number in self.notes.keys():
-                        if self.notes[midi_note_number] is not None:
-#                            print('BEND:', midi_note_number, self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][1], (midi_msg.pitch_bend - 8292) / 8292)
-                            self.frequency_shift(midi_note_number, self.notes_pitch[midi_note_number][0], self.notes_pitch[midi_note_number][1], (midi_msg.pitch_bend - 8292) / 8292)
-#                            print('NOTE FREQ:', midi_note_number, self.notes[midi_note_number].frequency)
+                    for voice in self._voices:
+                        if voice.synth_note is not None and not voice.released:
+#                            print('BEND:', voice.number, voice.pitch[0], voice.pitch[1], (midi_msg.pitch_bend - 8292) / 8292)
+                            self.frequency_shift(voice, voice.pitch[0], voice.pitch[1], (midi_msg.pitch_bend - 8292) / 8292)
+#                            print('NOTE FREQ:', voice.number, voice.synth_note.frequency)
 
                 # Not unison mode
                 if unison_heltz == 0:
@@ -1257,45 +1833,55 @@ class MIDI_class:
                 unison_heltz = 0
 
         # Filter LFO and ADSR (ADSlSr) modulation
-        if len(self.filters) > 0:
-            for note in self.notes.keys():
-#                print('UPDATE NOTE FILTER:', note, self.filters[note], self.synthIO.filter(self.filters[note]))
-                self.notes[note].filter=self.synthIO.filter(self.filters[note])['FILTER']
-
-        # Change the note wave shape along the VCA envelope phase
-        for midi_note_number in self.notes.keys():
-            if self.notes[midi_note_number] is not None:
-                note = self.notes[midi_note_number]
-                env = SynthIO.synth().note_info(note)
-                wave = self.notes_phase[midi_note_number]['wave']
-#                print('ENV PHASE:', midi_note_number, env, self.notes_phase[midi_note_number])
-                
-                if self.notes_phase[midi_note_number]['envelope'] != env[0]:
-                    self.notes_phase[midi_note_number]['envelope'] = env[0]
-#                    print('ENV PHASE:', midi_note_number, env)
-                    if   env[0] == synthio.EnvelopeState.DECAY:
-                        wave = 3
-                    elif env[0] == synthio.EnvelopeState.SUSTAIN:
-                        wave = 6
-                    else:
-                        wave = 0
-                        
-                if   env[0] == synthio.EnvelopeState.ATTACK:
-                    if   env[1] >= self.notes_phase[midi_note_number]['attack2']:
-                        wave = 2
-                    elif env[1] >= self.notes_phase[midi_note_number]['attack1']:
-                        wave = 1
-                
-                elif env[0] == synthio.EnvelopeState.DECAY:
-                    if   env[1] <  self.notes_phase[midi_note_number]['decay2']:
-                        wave = 5
-                    elif env[1] <  self.notes_phase[midi_note_number]['decay1']:
-                        wave = 4
+        for voice in self._voices:
+            if voice.synth_note is not None and not voice.released:
+#                print('UPDATE NOTE FILTER:', voice.number, self.synthIO.filter(voice.number))
+                voice.synth_note.filter=self.synthIO.filter(voice.number)['FILTER']
+                if voice.ring_note is not None:
+                    voice.ring_note.filter=voice.synth_note.filter
+
+        # Change the note wave shapes along the VCA envelope phases at the deadlines
+        now = Ticks.ms()
+        while self._deadlines_size > 0 and Ticks.diff(now, self._deadlines[0].deadline) >= 0:
+            voice = self._deadlines[0]
+            self.unschedule(voice)
+
+            # Free the released voice at the end of the release phase, or check it again later
+            if voice.released:
+                if self.synthesizer.note_info(voice.synth_note)[0] is None:
+                    self.voice_free(voice)
+                else:
+                    self.schedule(voice, Ticks.add(now, MIDI_class.RELEASE_CHECK_MS))
 
-                if wave != self.notes_phase[midi_note_number]['wave']:
-                    note.waveform[:] = SynthIO.wave_shape(wave)
-                    self.notes_phase[midi_note_number]['wave'] = wave
-#                    print('WAVE:', env, self.notes_phase[midi_note_number], note.waveform)
+                continue
+
+            # The latest phase passed
+            elapsed = Ticks.diff(now, voice.start)
+            wave = voice.wave
+            while wave < 6 and elapsed >= voice.phase_times[wave]:
+                wave += 1
+
+            # Next phase change (no change in the sustain phase)
+            if wave < 6:
+                self.schedule(voice, Ticks.add(voice.start, voice.phase_times[wave]))
+
+#            print('ENV PHASE:', voice.number, elapsed, voice.wave, wave)
+            if wave != voice.wave:
+                wave_shape = SynthIO.wave_shape(wave, note=voice.note, velocity=voice.velocity)
+                self.wave_switches += 1
+                
+                # Swap the wave table of the note (the phases sharing the same wave table need nothing)
+                #   The regeneration makes new wave tables, so the notes keep playing the tables they refer.
+                if wave_shape is not voice.table:
+                    voice.synth_note.waveform = wave_shape
+                    if voice.ring_note is not None:
+                        voice.ring_note.waveform = wave_shape
+
+                    self.wave_swaps += 1
+                    
+                voice.table = wave_shape
+                voice.wave = wave
+#                print('WAVE:', voice.number, voice.wave, voice.synth_note.waveform)
 
     # Receive MIDI events
     def receive_midi_events(self, midi_msg=None):
@@ -1308,16 +1894,93 @@ class MIDI_class:
 
     # All playing notes off
     def all_notes_off(self):
-        for midi_note_number in self.notes.keys():
-            if self.notes[midi_note_number] is not None:
-#                print('ALL NOTES OFF:', midi_note_number)
-                self.synthesizer.release(self.notes[midi_note_number])
-                del self.notes[midi_note_number]
-                self.notes_stack.remove(midi_note_number)
-                self.synthIO.filter_release(self.filters[midi_note_number])
-                del self.filters[midi_note_number]
+        for voice in self._voices:
+            if voice.synth_note is not None:
+#                print('ALL NOTES OFF:', voice.number, voice.note)
+                self.voice_free(voice)
                 
         self.synthesizer.release_all()
+
+    # Benchmark the note on path
+    #   COLD: note ons making the notes, the waveform buffers, the envelopes and the filters (the cost without the pools)
+    #   WARM: note ons reusing them after the release phases end
+    #   Prints and returns the time and the heap allocation per note on (gc is disabled while measuring).
+    def benchmark_note_on(self, notes=None):
+        if notes is None:
+            notes = SynthIO_class.MAX_VOICES
+
+        self.all_notes_off()
+        for voice in self._voices:
+            voice.pool_note = None
+            voice.pool_ring_note = None
+
+        self._envelopes = {}
+        SynthIO._start_filter_params[0] = None
+        messages = []
+        for note in list(range(notes)):
+            messages.append(NoteOn(60 + note, 100))
+
+        results = {}
+        for run in ['COLD', 'WARM']:
+            gc.collect()
+            mem_alloc = gc.mem_alloc()
+            gc.disable()
+            try:
+                start = Ticks.ms()
+                for midi_msg in messages:
+                    self.treat_midi_event(midi_msg)
+
+                msec = Ticks.diff(Ticks.ms(), start)
+                allocated = gc.mem_alloc() - mem_alloc
+
+            finally:
+                gc.enable()
+
+            results[run] = {'MSEC': msec / notes, 'ALLOCATED': allocated // notes}
+            print('NOTE ON', run + ':', results[run]['MSEC'], 'msec', 'ALLOCATED:', results[run]['ALLOCATED'], 'bytes')
+
+            # Wait for the end of the release phases to reuse the notes
+            self.all_notes_off()
+            start = Ticks.ms()
+            while Ticks.diff(Ticks.ms(), start) < 10000:
+                sounding = False
+                for voice in self._voices:
+                    if voice.pool_note is not None and self.synthesizer.note_info(voice.pool_note)[0] is not None:
+                        sounding = True
+
+                if not sounding:
+                    break
+
+        return results
+
+    # Benchmark the envelope phase changes under a dense chord workload
+    #   Plays a chord of the max voices again every interval msec for the duration msec.
+    #   Prints and returns the phase changes and the wave table swaps per second,
+    #   and the samples per second the wave table copies would take (a swap copies nothing).
+    def benchmark_phase_switch(self, duration=5000, interval=200):
+        messages = []
+        for note in list(range(SynthIO_class.MAX_VOICES)):
+            messages.append(NoteOn(48 + note * 2, 100))
+
+        self.all_notes_off()
+        self.wave_switches = 0
+        self.wave_swaps    = 0
+        start = Ticks.ms()
+        chord = None
+        while Ticks.diff(Ticks.ms(), start) < duration:
+            if chord is None or Ticks.diff(Ticks.ms(), chord) >= interval:
+                chord = Ticks.ms()
+                for midi_msg in messages:
+                    self.treat_midi_event(midi_msg)
+
+            else:
+                self.treat_midi_event(None)
+
+        seconds = Ticks.diff(Ticks.ms(), start) / 1000
+        self.all_notes_off()
+        result = {'SWITCHES': self.wave_switches / seconds, 'SWAPS': self.wave_swaps / seconds, 'SAMPLES': self.wave_swaps * len(SynthIO.wave_shape(0)) / seconds}
+        print('PHASE SWITCHES:', result['SWITCHES'], '/sec', 'SWAPS:', result['SWAPS'], '/sec', 'SAMPLES NOT COPIED:', result['SAMPLES'], '/sec')
+        return result
         
 
 ################# End of MIDI Class Definition #################
@@ -1327,12 +1990,14 @@ class MIDI_class:
 # CLASS: Wave shape generator with FM synthesis
 ################################################
 class FM_Waveshape_class:
-    OPERATOR_MAX        = 4					# 4 operators
+    OPERATOR_MAX        = 8					# 8 operators (the operators 4..7 are only in the sound file)
+    OPERATOR_EDITABLE   = 4					# Operators on the edit pages
     OSC_LEVEL_MAX       = 255.0				# Oscillator output level for user (LEVEL: 0..255)
     OSC_MODULATION_MAX  = 50.0				# Modulation oscillator internal output level (LEVEL: 0..25.0)
     OSC_FREQ_RESOLUTION = 100.0				# Oscillator frequency resolution (FREQ: 1..51200 --> 512.00, fraction makes NON-integer overtone)
     
-    SAMPLE_SIZE     = 512					# Sampling size
+    SAMPLE_SIZE     = 512					# Sampling size (wave table size, see sample_size())
+    SAMPLE_SIZES    = (256, 512, 1024, 2048)	# Selectable wave table sizes
     SAMPLE_VOLUME   = 32000					# Maximum sampling volume 0-32000
     SAMPLE_VOLUME_f = 32000.0				# Maximum sampling volume 0.0-32000.0
     SAMPLE_RATE     = 22050					# Sampling rate
@@ -1348,27 +2013,64 @@ class FM_Waveshape_class:
     WAVE_SINE_ABS    = 4
     WAVE_SINE_PLUS   = 5
     WAVE_WHITE_NOISE = 6
+    WAVE_SAMPLING1   = 7
+    WAVE_SAMPLING2   = 8
+    WAVE_SAMPLING3   = 9
+    WAVE_SAMPLING4   = 10
     
-    # Audio output operators for each algorithm
-    AUDIO_OUTPUT_OPERATOR = [
-        (1,),
-        (1,),
-        (0,1,2,3),
-        (3,),
-        (3,),
-        (1,3),
-        (0,3),
-        (0,2,3),
-        (1,2,3),
-        (2,3),
-        (1,2,3)
+    # Algorithms (operator graphs)
+    #   feedback  : operators with the self feedback (only for the operators without modulator)
+    #   modulation: {carrier operator: (modulator operators)}, the other operators use the feedback value as the modulator phase shift
+    #   outputs   : audio output operators
+    #   levels    : audio output operators counted to adjust the output level (optional, the same as outputs)
+    ALGORITHMS = [
+        {'feedback': (0,),    'modulation': {1: (0,)},                 'outputs': (1,)},		# 0: <0>-->1-->
+        {'feedback': (0,),    'modulation': {},                        'outputs': (0,1), 'levels': (1,)},	# 1: (<0> + 1)-->
+        {'feedback': (0,2),   'modulation': {},                        'outputs': (0,1,2,3)},	# 2: (<0> + 1 + <2> + 3)-->
+        {'feedback': (0,1),   'modulation': {2: (1,), 3: (0,2)},       'outputs': (3,)},		# 3: (<0> + (<1>-->2))-->3-->
+        {'feedback': (0,),    'modulation': {1: (0,), 2: (1,), 3: (2,)}, 'outputs': (3,)},		# 4: <0>-->1-->2-->3-->
+        {'feedback': (0,2),   'modulation': {1: (0,), 3: (2,)},        'outputs': (1,3)},		# 5: ((<0>-->1) + (<2>-->3))-->
+        {'feedback': (0,1),   'modulation': {2: (1,), 3: (2,)},        'outputs': (0,3)},		# 6: (<0> + (<1>-->2-->3))-->
+        {'feedback': (0,1,3), 'modulation': {2: (1,)},                 'outputs': (0,2,3)},	# 7: (<0> + (<1>-->2) + <3>)-->
+        {'feedback': (0,3),   'modulation': {1: (0,), 2: (0,)},        'outputs': (1,2,3)},	# 8: (<0>-->(1 + 2)) + <3>)-->
+        {'feedback': (0,),    'modulation': {1: (0,), 2: (1,), 3: (0,)}, 'outputs': (2,3)},	# 9: <0>-->((1-->2) + 3)-->
+        {'feedback': (0,),    'modulation': {1: (0,), 2: (0,), 3: (0,)}, 'outputs': (1,2,3)}	# 10: <0>-->(1 + 2 + 3)-->
     ]
 
     # Additive synthesis
-    SINE_OSCILLATOR_MAX = 8		# Number of sine wave oscillators
+    SINE_OSCILLATOR_MAX = 8		# Number of sine wave oscillators editable
+    ADDITIVE_PARTIALS_MAX = 64		# Number of partials in a sound file (oscillators 8.. are only in the file)
+
+    # Wave shapes along the VCA envelope phases
+    ENVELOPE_PHASES = 7
+
+    # Band-limited wave tables for each octave of the MIDI notes (0..127)
+    MIPMAP_OCTAVES = 11
+    MIPMAP_THRESHOLD = 1.0			# Harmonics under this level (LSB) are ignored
+    MIPMAP_SIZE = 512				# Band-limited wave tables are at most this size unless they need more samples
+
+    # Analytic FM synthesis of the sine operator graphs (see fm_graph_analytic())
+    ANALYTIC_BESSEL_MIN = 0.000001	# Sidebands under this Bessel function level are ignored
+    ANALYTIC_LEVEL_MIN  = 0.0001	# Modulator partials under this level (radian) are ignored
+    ANALYTIC_COST_MAX   = 8000		# Maximum number of the sideband products, over this uses the wave calculation
+
+    # Number of base wave cycles cached
+    CYCLE_CACHE_MAX = 16
+
+    # Maximum value of the int16 waves (fixed point)
+    FIXED_POINT_MAX = 32767.0
+
+    # Bytes of the operator output waves cached
+    OPERATOR_CACHE_BYTES = 65536
+
+    # Operator parameters for the additive waves envelope
+    ADDITIVE_FACTORS = ('attack_additive', 'decay_additive', 'sustain_additive')
 
     def __init__(self):
-        self._algorithm = [(self.fm_algorithm0, (0,1)), (self.fm_algorithm1, (0,1)), (self.fm_algorithm2, (0,1,2,3)), (self.fm_algorithm3, (0,1,2,3)), (self.fm_algorithm4, (0,1,2,3)), (self.fm_algorithm5, (0,1,2,3)), (self.fm_algorithm6, (0,1,2,3)), (self.fm_algorithm7, (0,1,2,3)), (self.fm_algorithm8, (0,1,2,3)), (self.fm_algorithm9, (0,1,2,3)), (self.fm_algorithm10, (0,1,2,3))]
+        self._algorithm = []
+        for graph in FM_Waveshape_class.ALGORITHMS:
+            self._algorithm.append(self.make_graph(graph))
+
         self._waveshape = [
             self.wave_sine, self.wave_saw, self.wave_triangle, self.wave_square50,
             self.wave_sine_abs, self.wave_sine_plus, self.wave_white_noise,
@@ -1379,7 +2081,7 @@ class FM_Waveshape_class:
             self._oscillators.append({'waveshape': 0, 'frequency': 1, 'freq_decimal': 0, 'feedback': 0, 'amplitude': 1, 'adsr': [],
                                       'attack_factor': 1.0, 'attack_additive': 1.0, 'decay_additive': 1.0,
                                       'decay_factor': 1.0, 'sustain_additive': 1.0, 'sustain_factor': 1.0,
-                                      'muted': 0})
+                                      'muted': 0 if osc < FM_Waveshape_class.OPERATOR_EDITABLE else 1})
             
         # Sampling wave names
         self._sampling_file = ['', '', '', '']
@@ -1387,13 +2089,148 @@ class FM_Waveshape_class:
         # Output levels adjusted
         self._adjust_output_level = 1.0
 
+        # Harmonic limit of the analytic FM synthesis (0: off, the FM waves are calculated in the time domain)
+        self._analytic_harmonics = 0
+
+        # Sample positions in a cycle (float for the phases, int16 for the modulation kernel)
+        self._sample_position = np.arange(FM_Waveshape_class.SAMPLE_SIZE, dtype=np.float)
+        self._sample_index    = np.arange(FM_Waveshape_class.SAMPLE_SIZE, dtype=np.int16)
+
+        # Scratch arrays for the temporary calculations {shape: array}
+        self._scratch = {}
+        self.allocate_scratch()
+
+        # Base wave cycles cache {(shape, fn): cycle}
+        self._cycle_generator = {
+            FM_Waveshape_class.WAVE_SAW: self.cycle_saw, FM_Waveshape_class.WAVE_TRIANGLE: self.cycle_triangle,
+            FM_Waveshape_class.WAVE_SQUARE50: self.cycle_square50, FM_Waveshape_class.WAVE_WHITE_NOISE: self.cycle_white_noise,
+            FM_Waveshape_class.WAVE_SINE: self.cycle_sine
+        }
+        self._cycle_cache = {}
+        self._cycle_keys  = []
+
+        # Maximum harmonic under the Nyquist frequency in each octave (the highest note in the octave, at least the fundamental)
+        self._mipmap_harmonics = []
+        for octave in list(range(FM_Waveshape_class.MIPMAP_OCTAVES)):
+            note_hz = 440.0 * 2 ** ((octave * 12 + 11 - 69) / 12)
+            self._mipmap_harmonics.append(max(1, int(FM_Waveshape_class.SAMPLE_RATE / 2 / note_hz)))
+
+        # Operator output waves cache (LRU) {key: wave} and the bytes of the waves
+        self._operator_cache       = OrderedDict()
+        self._operator_cache_bytes = 0
+        self.operator_cache_hits   = 0
+        self.operator_cache_misses = 0
+
+        # Waves generated for all phases (None or no key: need to generate)
+        #   FM waves and additive waves (phases x SAMPLE_SIZE, or SAMPLE_SIZE for the same waves in all phases),
+        #   wave tables (FM + additive in int16 for each phase), and the generation condition
+        #   The wave tables are kept for each modulator level scale, the FM waves only for the full velocity scale 1.0
+        #   (see fm_algorithm_steps()).
+        self._fm_waves       = {}
+        self._additive_waves = None
+        self._wave_tables    = {}
+        self._wave_condition = None
+        self._wave_serial    = 0		# Count up at each invalidation
+
     # Set and get an sampling file name
     def sampling_file(self, wave_no, name=None):
         if name is not None:
-            self._sampling_file[wave_no] = name
+            if self._sampling_file[wave_no] != name:
+                self._sampling_file[wave_no] = name
+
+                # Operators using the sampling wave have been changed
+                for osc in self._oscillators:
+                    if osc['waveshape'] == FM_Waveshape_class.WAVE_SAMPLING1 + wave_no:
+                        self.invalidate_waves(True, False)
             
         return self._sampling_file[wave_no]
 
+    # Invalidate the FM waves and/or the additive waves generated in all phases
+    #   The waves will be regenerated at the next fm_algorithm() call.
+    #   The waves being generated at this time (see fm_algorithm_steps()) are never kept.
+    #   The wave tables made of the waves are discarded too.
+    def invalidate_waves(self, fm_waves=True, additive_waves=True):
+        self._wave_serial += 1
+        if fm_waves or additive_waves:
+            self._wave_tables = {}
+
+        if fm_waves:
+            self._fm_waves = {}
+            
+        if additive_waves:
+            self._additive_waves = None
+
+    # Discard the waves generated with the modulator level scales not in use
+    def prune_waves(self, scales):
+        for scale in list(self._fm_waves.keys()):
+            if scale not in scales:
+                del self._fm_waves[scale]
+
+        for scale in list(self._wave_tables.keys()):
+            if scale not in scales:
+                del self._wave_tables[scale]
+
+    # Set and get the wave table size
+    #   The cycles and the operator waves cached are discarded for a new size.
+    #   The sampling wave cache holds SAMPLE_CACHE_WAVES waves of the size.
+    def sample_size(self, size=None):
+        if size in FM_Waveshape_class.SAMPLE_SIZES and size != FM_Waveshape_class.SAMPLE_SIZE:
+#            print('SAMPLE SIZE:', FM_Waveshape_class.SAMPLE_SIZE, '-->', size)
+            FM_Waveshape_class.SAMPLE_SIZE = size
+            FM_Waveshape_class.half_period = size // 2
+            ADC_MIC_class.SAMPLE_CACHE_BYTES = ADC_MIC_class.SAMPLE_CACHE_WAVES * size * 2
+            self._sample_position = np.arange(size, dtype=np.float)
+            self._sample_index    = np.arange(size, dtype=np.int16)
+            self.allocate_scratch()
+            self._cycle_cache = {}
+            self._cycle_keys  = []
+            self.clear_operator_cache()
+            self.invalidate_waves()
+
+        return FM_Waveshape_class.SAMPLE_SIZE
+
+    # Allocate the scratch arrays for the current wave table size
+    #   The inverse FFT buffers, a phase ramp (SAMPLE_SIZE) and the phase rows (phases x SAMPLE_SIZE)
+    #   for the phases and the sample positions of the modulation, and the sum of the output waves.
+    def allocate_scratch(self):
+        self._scratch = {}
+        self._scratch['real'] = np.zeros(FM_Waveshape_class.SAMPLE_SIZE)
+        self._scratch['imag'] = np.zeros(FM_Waveshape_class.SAMPLE_SIZE)
+        self._scratch['ramp'] = np.zeros(FM_Waveshape_class.SAMPLE_SIZE)
+        self._scratch['rows'] = np.zeros((FM_Waveshape_class.ENVELOPE_PHASES, FM_Waveshape_class.SAMPLE_SIZE))
+
+    # Get a scratch array, the contents are undefined
+    #   Use it only for a temporary calculation in a function, never return it.
+    def scratch(self, name):
+        return self._scratch[name]
+
+    # Get the phase rows scratch array in the shape of a wave (SAMPLE_SIZE or rows x SAMPLE_SIZE)
+    def scratch_rows(self, shape):
+        if len(shape) == 1:
+            return self._scratch['rows'][0]
+
+        return self._scratch['rows'][:shape[0]]
+
+    # Peak level of a wave (without a new array of the absolute values)
+    def peak(self, wave):
+        return max(np.max(wave), -np.min(wave))
+
+    # Clip a wave in -volume..volume (a new array only if some samples are out of the range)
+    def clip_wave(self, wave, volume):
+        if np.max(wave) > volume or np.min(wave) < -volume:
+            return np.clip(wave, -volume, volume)
+
+        return wave
+
+    # Scale a wave by a level (a float or the phases levels column)
+    #   The wave must be a new float array made in the caller, it is scaled in place unless the shape changes.
+    def scale_wave(self, wave, ansv):
+        if isinstance(ansv, np.ndarray) and len(wave.shape) == 1:
+            return wave * ansv
+
+        wave *= ansv
+        return wave
+
     # Set and Get an oscillator
     def oscillator(self, osc_num, specs = None):
         if osc_num < 0 or osc_num >= FM_Waveshape_class.OPERATOR_MAX:
@@ -1404,26 +2241,58 @@ class FM_Waveshape_class:
         
         for ky in self._oscillators[osc_num].keys():
             if ky in specs:
-                self._oscillators[osc_num][ky] = specs[ky]
+                if self._oscillators[osc_num][ky] != specs[ky]:
+                    self._oscillators[osc_num][ky] = specs[ky]
+
+                    # The FM waves never refer the additive factors, the additive waves refer only them
+                    self.invalidate_waves(not ky in FM_Waveshape_class.ADDITIVE_FACTORS, ky in FM_Waveshape_class.ADDITIVE_FACTORS or ky == 'attack_factor')
                 
         return self._oscillators[osc_num]
 
+    # Phase modulation kernel for the wave tables (saw, triangle, square, sampling)
+    #   Read the base cycle at (sample position + modulator) wrapped in the cycle.
+    #   Same result as 'wave[(tm + int(modulator[tm])) % SAMPLE_SIZE]' for all tm.
+    #   The modulator may have the phases rows (phases x SAMPLE_SIZE).
+    #   The sample positions are int16, an overflow wraps around 65536 (a multiple of SAMPLE_SIZE),
+    #   then np.take() wraps them in the cycle.
+    def modulate_wave(self, wave, modulator):
+        position = np.array(modulator, dtype=np.int16)
+        position += self._sample_index
+        if len(position.shape) > 1:
+            return np.take(wave, position.flatten(), mode='wrap').reshape(position.shape)
+
+        return np.take(wave, position, mode='wrap')
+
     # Generate sine wave
+    #   The phases are calculated in the scratch arrays.
     def wave_sine(self, adsr, an, fn, modulator=None):
         ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
         
+        phase = self.scratch('ramp')
+        phase[:] = self._sample_position
+        phase *= FM_Waveshape_class.PI2 * fn / FM_Waveshape_class.SAMPLE_SIZE
+        
         # Without modulation
         if modulator is None:
 #            print('SIN no-mod:', an, ansv, fn, FM_Waveshape_class.SAMPLE_SIZE, len(adsr))
-            wave = np.array(np.sin(np.linspace(0, FM_Waveshape_class.PI2 * fn, FM_Waveshape_class.SAMPLE_SIZE, endpoint=False)) * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv)
+            wave = np.sin(phase)
 #            print('SIN no-mod:', an, ansv, len(wave), wave)
         
         # With modulation
         else:
-            wave = np.array(np.sin(np.linspace(0, FM_Waveshape_class.PI2 * fn, FM_Waveshape_class.SAMPLE_SIZE, endpoint=False) + modulator) * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv)
+            if len(modulator.shape) == 1:
+                phase += modulator
+            else:
+                ramp = phase
+                phase = self.scratch_rows(modulator.shape)
+                phase[:] = modulator
+                phase += ramp
+
+            wave = np.sin(phase)
 #            print('SIN ad-mod:', an, ansv, len(wave), wave)
 
-        return wave
+        wave *= (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME
+        return self.scale_wave(wave, ansv)
 
     # Generate abs(sine) wave
     def wave_sine_abs(self, adsr, an, fn, modulator=None):
@@ -1431,15 +2300,15 @@ class FM_Waveshape_class:
 
     # Generate plus(sine) wave
     def wave_sine_plus(self, adsr, an, fn, modulator=None):
-        wave = self.wave_sine(adsr, an, fn, modulator)
-        wave = np.where(wave < 0.0, 0.0, wave)
-        return wave
+        return np.maximum(self.wave_sine(adsr, an, fn, modulator), 0.0)
 
-    # Generate saw wave
-    def wave_saw(self, adsr, an, fn, modulator=None):
-        ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
-        
-        cycle = int(FM_Waveshape_class.SAMPLE_SIZE / fn)
+    # Make a sine wave cycle (-1.0..1.0), the basis of the non-integer additive partials
+    def cycle_sine(self, fn):
+        return np.sin(np.linspace(0, FM_Waveshape_class.PI2 * fn, FM_Waveshape_class.SAMPLE_SIZE, endpoint=False))
+
+    # Make a saw wave cycle (-1.0..1.0)
+    def cycle_saw(self, fn):
+        cycle = max(1, int(FM_Waveshape_class.SAMPLE_SIZE / fn))
         vstep = 2.0 / cycle
         wave = []
         tm = 0
@@ -1450,39 +2319,13 @@ class FM_Waveshape_class:
             if vl >= 1.0:
                 vl = -1.0
             tm += 1
-            
-        wave = np.array(wave)
 
-        # Without modulation
-        if modulator is None:
-            wave = wave * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
-#            print('SAW no-mod:', an, ansv, len(wave), wave)
-        
-        # With modulation
-        else:
-            # Compress in the sample volume
-#            print('modl0:', modulator)
-##            modulator = modulator * FM_Waveshape_class.SAMPLE_SIZE / FM_Waveshape_class.OSC_MODULATION_MAX
-#            print('modl1:', modulator)
-            comp = np.array(modulator, dtype=np.int16)
-            
-            # Modulation
-#            print('comp1:', comp)
-            mod_wave = []
-            tm = 0
-            for idx in comp:
-                mod_wave.append(wave[(tm + idx) % FM_Waveshape_class.SAMPLE_SIZE])
-                tm += 1
-                
-            wave = np.array(mod_wave) * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
-#            print('SAW ad-mod:', an, ansv, len(wave), wave)
+        return np.array(wave)
 
-        return wave
-
-    # Generate triangle wave
-    def wave_triangle(self, adsr, an, fn, modulator=None):
-        ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
-        cycle = int(FM_Waveshape_class.SAMPLE_SIZE / fn / 4)
+    # Make a triangle wave cycle (-1.0..1.0)
+    #   0.0 --> 1.0 at first, then 1.0 --> -1.0 --> 1.0 repeatedly.
+    def cycle_triangle(self, fn):
+        cycle = max(1, int(FM_Waveshape_class.SAMPLE_SIZE / fn / 4))
         vstep = 2.0 / cycle
         wave = []
         tm = 0
@@ -1498,126 +2341,130 @@ class FM_Waveshape_class:
             elif vl < -1.0:
                 vl = -1.0
                 phase = (phase + 1) % 4
-                
+
             tm += 1
-            
-        wave = np.array(wave)
 
-        # Without modulation
+        return np.array(wave)
+
+    # Make a square wave cycle (duty ratio 50%, -1.0 or 1.0)
+    def cycle_square50(self, fn):
+        cycle = max(1, int(FM_Waveshape_class.SAMPLE_SIZE / fn / 2))
+        phase = np.floor(self._sample_position / cycle)
+        phase = phase - np.floor(phase / 2) * 2
+        return 1.0 - phase * 2.0
+
+    # Make a white noise (the frequency is a random seed)
+    def cycle_white_noise(self, fn):
+        random.seed(int(fn))
+        wave = []
+        for tm in list(range(FM_Waveshape_class.SAMPLE_SIZE)):
+            wave.append(random.randint(-FM_Waveshape_class.SAMPLE_VOLUME + 1, FM_Waveshape_class.SAMPLE_VOLUME - 1))
+
+        return np.array(wave)
+
+    # Get a base wave cycle of a shape and a frequency
+    #   Base cycles are cached to share them among operators, phases and algorithms.
+    #   Never modify the returned array.
+    def base_cycle(self, shape, fn):
+        key = (shape, fn)
+        if key in self._cycle_cache:
+            return self._cycle_cache[key]
+
+        wave = self._cycle_generator[shape](fn)
+
+        # Remove the oldest cycle
+        if len(self._cycle_keys) >= FM_Waveshape_class.CYCLE_CACHE_MAX:
+            del self._cycle_cache[self._cycle_keys.pop(0)]
+
+        self._cycle_keys.append(key)
+        self._cycle_cache[key] = wave
+        return wave
+
+    # Generate saw wave
+    def wave_saw(self, adsr, an, fn, modulator=None):
+        ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
+        wave = self.base_cycle(FM_Waveshape_class.WAVE_SAW, fn)
+
+        # Without modulation (a new array from the base cycle cached)
+        if modulator is None:
+            wave = wave * ((adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME)
+#            print('SAW no-mod:', an, ansv, len(wave), wave)
+        
+        # With modulation
+        else:
+            wave = self.modulate_wave(wave, modulator)
+            wave *= (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME
+#            print('SAW ad-mod:', an, ansv, len(wave), wave)
+
+        return self.scale_wave(wave, ansv)
+
+    # Generate triangle wave
+    def wave_triangle(self, adsr, an, fn, modulator=None):
+        ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
+        wave = self.base_cycle(FM_Waveshape_class.WAVE_TRIANGLE, fn)
+
+        # Without modulation (a new array from the base cycle cached)
         if modulator is None:
-            wave = wave * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
+            wave = wave * ((adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME)
 #            print('TRI no-mod:', an, ansv, len(wave), wave)
         
         # With modulation
         else:
-            # Compress in the sample volume
-#            print('modl0:', modulator)
-##            modulator = modulator * FM_Waveshape_class.SAMPLE_SIZE / FM_Waveshape_class.OSC_MODULATION_MAX
-#            print('modl1:', modulator)
-            comp = np.array(modulator, dtype=np.int16)
-            
-            # Modulation
-#            print('comp1:', comp)
-            mod_wave = []
-            tm = 0
-            for idx in comp:
-                mod_wave.append(wave[(tm + idx) % FM_Waveshape_class.SAMPLE_SIZE])
-                tm += 1
-                
-            wave = np.array(mod_wave) * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
+            wave = self.modulate_wave(wave, modulator)
+            wave *= (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME
 #            print('TRI ad-mod:', an, ansv, len(wave), wave)
 
-        return wave
+        return self.scale_wave(wave, ansv)
 
     # Generate square wave (duty ratio 50%)
     def wave_square50(self, adsr, an, fn, modulator=None):
         ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
-        cycle = int(FM_Waveshape_class.SAMPLE_SIZE / fn / 2)
-        wave = []
-        tm = 0
-        phase = 0
-        while tm < FM_Waveshape_class.SAMPLE_SIZE:
-            wave.append(1.0 if phase % 2 == 0 else -1.0)
-            tm += 1
-            if tm % cycle == 0:
-                phase = (phase + 1) % 2
+        wave = self.base_cycle(FM_Waveshape_class.WAVE_SQUARE50, fn)
 
-        wave = np.array(wave)
-
-        # Without modulation
+        # Without modulation (a new array from the base cycle cached)
         if modulator is None:
-            wave = wave * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
+            wave = wave * ((adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME)
 #            print('SQ5 no-mod:', an, ansv, len(wave), wave)
         
         # With modulation
         else:
             # Compress in the sample volume
-#            print('modl0:', modulator)
-##            modulator = modulator * FM_Waveshape_class.SAMPLE_SIZE / FM_Waveshape_class.OSC_MODULATION_MAX
-            modulator = np.where(modulator >  FM_Waveshape_class.SAMPLE_VOLUME_f,  FM_Waveshape_class.SAMPLE_VOLUME, modulator)
-            modulator = np.where(modulator < -FM_Waveshape_class.SAMPLE_VOLUME_f, -FM_Waveshape_class.SAMPLE_VOLUME, modulator)
-#            print('modl1:', modulator)
-            comp = np.array(modulator, dtype=np.int16)
-            
-            # Modulation
-#            print('comp1:', comp)
-            mod_wave = []
-            tm = 0
-            for idx in comp:
-                mod_wave.append(wave[(tm + idx) % FM_Waveshape_class.SAMPLE_SIZE])
-                tm += 1
-                
-            wave = np.array(mod_wave) * (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME * ansv
+            modulator = self.clip_wave(modulator, FM_Waveshape_class.SAMPLE_VOLUME_f)
+            wave = self.modulate_wave(wave, modulator)
+            wave *= (adsr if adsr is not None else 1.0) * FM_Waveshape_class.SAMPLE_VOLUME
 #            print('SQ5 ad-mod:', an, ansv, len(wave), wave)
 
-        return wave
+        return self.scale_wave(wave, ansv)
 
     # Generate white noise
     def wave_white_noise(self, adsr, an, fn, modulator=None):
         ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
-        random.seed(int(fn))
-        wave = []
-        for tm in list(range(FM_Waveshape_class.SAMPLE_SIZE)):
-            wave.append(random.randint(-FM_Waveshape_class.SAMPLE_VOLUME + 1, FM_Waveshape_class.SAMPLE_VOLUME - 1))
-
-        wave = np.array(wave) * ansv
+        wave = self.base_cycle(FM_Waveshape_class.WAVE_WHITE_NOISE, int(fn)) * 1.0
+        wave = self.scale_wave(wave, ansv)
 #        print('NOISE:', an, ansv, len(wave), wave)
         return wave
 
     def wave_sampling(self, wave_num, adsr, an, fn, modulator=None):
-        ADC_Mic.load_sampling_file(self.sampling_file(wave_num))
-#        print('LOADED SAMPLE:', len(ADC_MIC_class.SAMPLED_WAVE), ADC_MIC_class.SAMPLED_WAVE)
-        sample_wave = ADC_MIC_class.SAMPLED_WAVE
+        sample_wave = ADC_Mic.sampling_wave(self.sampling_file(wave_num))
+#        print('LOADED SAMPLE:', len(sample_wave), sample_wave)
         
-        if len(sample_wave) != FM_Waveshape_class.SAMPLE_SIZE:
+        if sample_wave is None or len(sample_wave) == 0:
             return self.wave_white_noise(adsr, an, fn, modulator)
+
+        # Resample a wave sampled in another wave table size
+        if len(sample_wave) != FM_Waveshape_class.SAMPLE_SIZE:
+            sample_wave = np.interp(self._sample_position * (len(sample_wave) / FM_Waveshape_class.SAMPLE_SIZE), np.arange(len(sample_wave), dtype=np.float), np.array(sample_wave, dtype=np.float))
     
         ansv = an / FM_Waveshape_class.SAMPLE_VOLUME_f
-        wave = []
 #        print('SAMPLE SIZE:', wave_num, FM_Waveshape_class.SAMPLE_SIZE, len(sample_wave))
         
-        # No modulation
-        if modulator is None:
-            for tm in list(range(FM_Waveshape_class.SAMPLE_SIZE)):
-                wave.append(sample_wave[tm] * (adsr[tm] if adsr is not None else 1.0) * ansv)
-#                print('TIMEn:', tm, sample_wave[tm], (adsr[tm] if adsr is not None else 1.0), ansv)
-
         # With modulation
-        else:
-            comp = np.array(modulator, dtype=np.int16)
-            for tm in list(range(FM_Waveshape_class.SAMPLE_SIZE)):
-                wave.append(sample_wave[tm] * (adsr[tm] if adsr is not None else 1.0) * ansv)
-#                print('TIMEm:', tm, sample_wave[tm], (adsr[tm] if adsr is not None else 1.0), ansv)
-
-            tm = 0
-            mod_wave = []
-            for idx in comp:
-                mod_wave.append(wave[(tm + idx) % FM_Waveshape_class.SAMPLE_SIZE])
-                tm += 1
-                
-            wave = mod_wave
+        if modulator is not None:
+            sample_wave = self.modulate_wave(sample_wave, modulator)
+
+        wave = sample_wave * (adsr if adsr is not None else 1.0)
+        wave = self.scale_wave(wave, ansv)
 
-        wave = np.array(wave)
 #        print('SAMPLING:', an, ansv, len(wave), wave)
         return wave
 
@@ -1633,28 +2480,140 @@ class FM_Waveshape_class:
     def wave_sampling4(self, adsr, an, fn, modulator=None):
         return self.wave_sampling(3, adsr, an, fn, modulator)
 
+    # Clear the operator output waves cache
+    def clear_operator_cache(self):
+        self._operator_cache       = OrderedDict()
+        self._operator_cache_bytes = 0
+        self.operator_cache_hits   = 0
+        self.operator_cache_misses = 0
+
+    # Get a modulator phase shift in samples (0: no shift)
+    def phase_shifter(self, phase_shift):
+        if phase_shift is None:
+            return 0
+
+        shifter = int(FM_Waveshape_class.SAMPLE_SIZE * phase_shift / 255)
+        if shifter <= 0 or shifter >= FM_Waveshape_class.SAMPLE_SIZE - 1:
+            return 0
+
+        return shifter
+
+    # Get a cache key of an operator output wave
+    #   key: (shape, level, frequency, modulator key, phase shift, sampling wave name)
+    #   A modulator is identified by its own key, so a key describes the whole operators sub-tree.
+    def operator_key(self, shape, an, fn, mod_key=None, phase_shift=None):
+        level_key = tuple(an.flatten().tolist()) if isinstance(an, np.ndarray) else an
+        shifter = 0 if mod_key is None else self.phase_shifter(phase_shift)
+        sampling = self._sampling_file[shape - FM_Waveshape_class.WAVE_SAMPLING1] if shape >= FM_Waveshape_class.WAVE_SAMPLING1 else ''
+        return (shape, level_key, fn, mod_key, shifter, sampling)
+
+    # Get a cache key of mixed waves
+    def mix_key(self, keys, fixed_point=False):
+        if len(keys) == 1 and not fixed_point:
+            return keys[0]
+
+        return (('+i',) if fixed_point else ('+',)) + tuple(keys)
+
+    # Get (wave=None) or Put a wave in the operator output waves cache
+    #   key is None: the wave is not cached
+    #   Never modify the waves in the cache.
+    def operator_cache(self, key, wave=None):
+        if key is None:
+            return wave
+
+        # Get a wave (the latest used wave moves to the end)
+        if wave is None:
+            if key in self._operator_cache:
+                self.operator_cache_hits += 1
+                wave = self._operator_cache.pop(key)
+                self._operator_cache[key] = wave
+                
+            else:
+                self.operator_cache_misses += 1
+
+            return wave
+
+        # A wave larger than the cache is not cached
+        wave_bytes = wave.size * wave.itemsize
+        if wave_bytes > FM_Waveshape_class.OPERATOR_CACHE_BYTES or key in self._operator_cache:
+            return wave
+
+        # Remove the least recently used waves
+        while self._operator_cache_bytes + wave_bytes > FM_Waveshape_class.OPERATOR_CACHE_BYTES:
+            old_wave = self._operator_cache.pop(next(iter(self._operator_cache)))
+            self._operator_cache_bytes -= old_wave.size * old_wave.itemsize
+
+        # Put a wave
+        self._operator_cache[key] = wave
+        self._operator_cache_bytes += wave_bytes
+        return wave
+
+    # Mix waves (the sum of the waves is cached as well)
+    #   keys: cache keys of the waves (None: not cached)
+    #   fixed_point: Mix the waves in float into an int16 wave
+    def mix_waves(self, waves, keys=None, fixed_point=False):
+        if len(waves) == 1 and not fixed_point:
+            return waves[0]
+
+        key = None if keys is None else self.mix_key(keys, fixed_point)
+        mixed = self.operator_cache(key)
+        if mixed is not None:
+            return mixed
+
+        # The waves are added in place after the first sum (a new array)
+        mixed = waves[0]
+        for wave in waves[1:]:
+            if mixed is not waves[0] and wave.shape == mixed.shape:
+                mixed += wave
+            else:
+                mixed = mixed + wave
+
+        if fixed_point:
+            mixed = self.fixed_point_wave(mixed)
+
+        return self.operator_cache(key, mixed)
+
+    # Convert a wave into an int16 wave
+    #   The mix of the audio outputs is kept in int16 to save the memory, it is converted only once
+    #   in the same way as the wave tables (the fraction is cut), so the wave tables are not changed.
+    #   A wave over the int16 range is kept in float not to lose the peaks reduced by the other waves later.
+    def fixed_point_wave(self, wave):
+        if self.peak(wave) > FM_Waveshape_class.FIXED_POINT_MAX:
+            return wave
+
+        return np.array(wave, dtype=np.int16)
+
     # Make an waveshape with a carrier and a modulator
-    def waveshape(self, shape, adsr, an, fn, modulator=None, phase_shift=None):
+    #   key: cache key made by operator_key() (None: not cached)
+    def waveshape(self, shape, adsr, an, fn, modulator=None, phase_shift=None, key=None):
 #        print('WAVESHAPE:', shape, an ,fn)
         adsr = None
 
-        # Modulator phase shift
+        # Cached operator output
+        wave = self.operator_cache(key)
+        if wave is not None:
+            return wave
+
+        # Modulator phase shift (along the samples in each phase)
+        shifter = 0 if modulator is None else self.phase_shifter(phase_shift)
         mod_phase = modulator
-        if phase_shift is not None and modulator is not None:
-            shifter = int(FM_Waveshape_class.SAMPLE_SIZE * phase_shift / 255)
-            if shifter > 0 and shifter < FM_Waveshape_class.SAMPLE_SIZE - 1:
-#                print('WAVE SHIFT:', shifter)
-                mod_phase = np.roll(modulator, shifter)
+        if shifter > 0:
+#            print('WAVE SHIFT:', shifter)
+            mod_phase = np.roll(modulator, shifter, axis=len(modulator.shape) - 1)
 
         # Make a wave shape
         wave = self._waveshape[shape](adsr, an, fn / FM_Waveshape_class.OSC_FREQ_RESOLUTION, mod_phase)
-        for w in list(range(len(wave))):
-            if wave[w] > FM_Waveshape_class.SAMPLE_VOLUME:
-                wave[w] = FM_Waveshape_class.SAMPLE_VOLUME
-            elif wave[w] < -FM_Waveshape_class.SAMPLE_VOLUME:
-                wave[w] = -FM_Waveshape_class.SAMPLE_VOLUME
+        wave = self.clip_wave(wave, FM_Waveshape_class.SAMPLE_VOLUME_f)
+        return self.operator_cache(key, wave)
 
-        return wave
+    # Make an operator level for the phases
+    #   Returns a level for the same levels in all phases, otherwise a column array of the levels (phases x 1).
+    def phase_levels(self, levels):
+        for level in levels[1:]:
+            if level != levels[0]:
+                return np.array(levels).reshape((len(levels), 1))
+
+        return levels[0]
 
     # Calculate an operator output level
     def operator_level(self, level, audio_operator = False):
@@ -1675,8 +2634,11 @@ class FM_Waveshape_class:
         if SynthIO is None:
             return 1.0
         
-        # VCO ADSR
+        # VCO ADSR (the operator not in the sound file has the factors in the oscillator)
         operator = SynthIO.wave_parameter(op_num)
+        if operator is None:
+            operator = self._oscillators[op_num]
+
         if   phase == 1:
 #            factor = (operator['decay_additive'] - operator['attack_additive']) / 3 + operator['attack_additive']
             factor = (operator['decay_factor'] - operator['attack_factor']) / 3 + operator['attack_factor']
@@ -1706,463 +2668,372 @@ class FM_Waveshape_class:
             
         return level * factor
 
-    # FM ALGORITHM-0: <0>-->1-->
-    def fm_algorithm0(self, osc_m, osc_c, phase=0):
-        # Modulator
-        wm = self._oscillators[osc_m]['waveshape']
-        bm = self._oscillators[osc_m]['feedback']
-        fm = self._oscillators[osc_m]['frequency'] * 100 + self._oscillators[osc_m]['freq_decimal']
-        am = self.operator_output_level(osc_m, phase)
-        tm = self._oscillators[osc_m]['adsr']
-        
-        # Carrier
-        wc = self._oscillators[osc_c]['waveshape']
-        bc = self._oscillators[osc_c]['feedback']
-        fc = self._oscillators[osc_c]['frequency'] * 100 + self._oscillators[osc_c]['freq_decimal']
-        ac = self.operator_output_level(osc_c, phase, True)
-        tc = self._oscillators[osc_c]['adsr']
-
-        # Without feedback0
-        if bm <= 0:
-            wave_shape = self.waveshape(wc, tc, ac, fc, self.waveshape(wm, tm, am, fm), bc)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(wm, tm, bm, fm)
-            feed_shape = self.waveshape(wm, tm, am, fm, base_shape)
-            wave_shape = self.waveshape(wc, tc, ac, fc, feed_shape, bc)
-        
-        return wave_shape
-    
-    # FM ALGORITHM-1: (<0> + 1)-->
-    def fm_algorithm1(self, osc_m, osc_c, phase=0):
-        # Modulator-1
-        wm = self._oscillators[osc_m]['waveshape']
-        bm = self._oscillators[osc_m]['feedback']
-        fm = self._oscillators[osc_m]['frequency'] * 100 + self._oscillators[osc_m]['freq_decimal']
-        am = self.operator_output_level(osc_m, phase, True)
-        tm = self._oscillators[osc_m]['adsr']
-        
-        # Modulator-2
-        wc = self._oscillators[osc_c]['waveshape']
-        bc = self._oscillators[osc_c]['feedback']
-        fc = self._oscillators[osc_c]['frequency'] * 100 + self._oscillators[osc_c]['freq_decimal']
-        ac = self.operator_output_level(osc_c, phase, True)
-        tc = self._oscillators[osc_c]['adsr']
-
-        # Without feedback0
-        if bm <= 0:
-            wave1 = self.waveshape(wm, tm, am, fm)
-            wave2 = self.waveshape(wc, tc, ac, fc, None, bc)
-            wave_shape = wave1 + wave2
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(wm, tm, bm, fm)
-            wave1 = self.waveshape(wm, tm, am, fm, base_shape)
-            wave2 = self.waveshape(wc, tc, ac, fc, None, bc)
-            wave_shape = wave1 + wave2
+    # Make an operator graph to generate a wave
+    #   Returns None for an invalid graph.
+    #   'order' is added to the graph: operators to generate in order (modulators first, only operators to the outputs)
+    def make_graph(self, graph):
+        try:
+            feedback   = tuple([int(op) for op in graph['feedback']])
+            outputs    = tuple([int(op) for op in graph['outputs']])
+            levels     = tuple([int(op) for op in graph['levels']]) if 'levels' in graph else outputs
+            modulation = {}
+            for op in graph['modulation'].keys():
+                modulation[int(op)] = tuple([int(m) for m in graph['modulation'][op]])
 
-        return wave_shape
-    
-    # FM ALGORITHM-2: ([0] + 1 + [2] + 3)-->
-    def fm_algorithm2(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        wave1 = self.fm_algorithm1(osc_ma, osc_ca, phase)
-        wave2 = self.fm_algorithm1(osc_mb, osc_cb, phase)
-        return np.array(wave1 + wave2)
-
-    # FM ALGORITHM-3: ( <0> + (<1> * 2) )-->3-->
-    def fm_algorithm3(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca]['waveshape']
-        f1 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b1 = self._oscillators[osc_ca]['feedback']
-        a1 = self.operator_output_level(osc_ca, phase)
-        t1 = self._oscillators[osc_ca]['adsr']
-
-        w2 = self._oscillators[osc_mb]['waveshape']
-        f2 = self._oscillators[osc_mb]['frequency'] * 100 + self._oscillators[osc_mb]['freq_decimal']
-        b2 = self._oscillators[osc_mb]['feedback']
-        a2 = self.operator_output_level(osc_mb, phase)
-        t2 = self._oscillators[osc_mb]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+            # Topological order from the outputs
+            order = []
+            visiting = []
+            def visit(op):
+                if op < 0 or op >= FM_Waveshape_class.OPERATOR_MAX or op in visiting:
+                    raise ValueError('Invalid operator graph')
 
-        # Without feedback1
-        if b1 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, self.waveshape(w1, t1, a1, f1), b2)
-            
-        # With feedback1
-        else:
-            base_shape = self.waveshape(w1, t1, b1, f1)
-            feed_shape = self.waveshape(w1, t1, a1, f1, base_shape)
-            wave2 = self.waveshape(w2, t2, a2, f2, feed_shape, b2)
-
-        wave02 = np.array(wave0 + wave2)
-        wave3 = self.waveshape(w3, t3, a3, f3, wave02, b3)
-        return wave3
-
-    # FM ALGORITHM-4: <0>-->1-->2-->3-->
-    def fm_algorithm4(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca]['waveshape']
-        f1 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b1 = self._oscillators[osc_ca]['feedback']
-        a1 = self.operator_output_level(osc_ca, phase)
-        t1 = self._oscillators[osc_ca]['adsr']
-
-        w2 = self._oscillators[osc_mb]['waveshape']
-        f2 = self._oscillators[osc_mb]['frequency'] * 100 + self._oscillators[osc_mb]['freq_decimal']
-        b2 = self._oscillators[osc_mb]['feedback']
-        a2 = self.operator_output_level(osc_mb, phase)
-        t2 = self._oscillators[osc_mb]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
-
-        wave1 = self.waveshape(w1, t1, a1, f1, wave0, b1)
-        wave2 = self.waveshape(w2, t2, a2, f2, wave1, b2)
-        wave3 = self.waveshape(w3, t3, a3, f3, wave2, b3)
-        return wave3
-
-    # FM ALGORITHM-5: ( (<0>-->1) + (<2>-->3) )-->
-    def fm_algorithm5(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        wave1 = self.fm_algorithm0(osc_ma, osc_ca, phase)
-        wave2 = self.fm_algorithm0(osc_mb, osc_cb, phase)
-        return np.array(wave1 + wave2)
-
-    # FM ALGORITHM-6: ( <0> + (<1>-->2-->3) )-->
-    def fm_algorithm6(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase, True)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca]['waveshape']
-        f1 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b1 = self._oscillators[osc_ca]['feedback']
-        a1 = self.operator_output_level(osc_ca, phase)
-        t1 = self._oscillators[osc_ca]['adsr']
-
-        w2 = self._oscillators[osc_mb]['waveshape']
-        f2 = self._oscillators[osc_mb]['frequency'] * 100 + self._oscillators[osc_mb]['freq_decimal']
-        b2 = self._oscillators[osc_mb]['feedback']
-        a2 = self.operator_output_level(osc_mb, phase)
-        t2 = self._oscillators[osc_mb]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+                if op not in order:
+                    visiting.append(op)
+                    for m in modulation.get(op, ()):
+                        visit(m)
 
-        # Without feedback1
-        if b1 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, self.waveshape(w1, t1, a1, f1))
-            
-        # With feedback1
-        else:
-            base_shape = self.waveshape(w1, t1, b1, f1)
-            feed_shape = self.waveshape(w1, t1, a1, f1, base_shape)
-            wave2 = self.waveshape(w2, t2, a2, f2, feed_shape, b2)
+                    visiting.remove(op)
+                    order.append(op)
 
-        wave3 = self.waveshape(w3, t3, a3, f3, wave2, b3)
-        
-        wave03 = np.array(wave0 + wave3)
-        return wave03
-
-    # FM ALGORITHM-7: ( <0> + (<1>-->2) + <3> )-->
-    def fm_algorithm7(self, osc_ma, osc_ca, osc_mb, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase, True)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca]['waveshape']
-        f1 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b1 = self._oscillators[osc_ca]['feedback']
-        a1 = self.operator_output_level(osc_ca, phase)
-        t1 = self._oscillators[osc_ca]['adsr']
-
-        w2 = self._oscillators[osc_mb]['waveshape']
-        f2 = self._oscillators[osc_mb]['frequency'] * 100 + self._oscillators[osc_mb]['freq_decimal']
-        b2 = self._oscillators[osc_mb]['feedback']
-        a2 = self.operator_output_level(osc_mb, phase, True)
-        t2 = self._oscillators[osc_mb]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+            for op in outputs:
+                visit(op)
 
-        # Without feedback3
-        if b3 <= 0:
-            wave3 = self.waveshape(w3, t3, a3, f3)
-            
-        # With feedback3
-        else:
-            base_shape = self.waveshape(w3, t3, b3, f3)
-            wave3 = self.waveshape(w3, t3, a3, f3, base_shape)
+            return {'feedback': feedback, 'modulation': modulation, 'outputs': outputs, 'levels': levels, 'order': tuple(order)}
 
-        # Without feedback1
-        if b1 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, self.waveshape(w1, t1, a1, f1))
-            
-        # With feedback1
-        else:
-            base_shape = self.waveshape(w1, t1, b1, f1)
-            feed_shape = self.waveshape(w1, t1, a1, f1, base_shape)
-            wave2 = self.waveshape(w2, t2, a2, f2, feed_shape, b2)
-        
-        wave023 = np.array(wave0 + wave2 + wave3)
-        return wave023
-
-    # FM ALGORITHM-8: <1>-->(2+3)+<4>-->
-    def fm_algorithm8(self, osc_ma, osc_ca1, osc_ca2, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca1]['waveshape']
-        f1 = self._oscillators[osc_ca1]['frequency'] * 100 + self._oscillators[osc_ca1]['freq_decimal']
-        b1 = self._oscillators[osc_ca1]['feedback']
-        a1 = self.operator_output_level(osc_ca1, phase, True)
-        t1 = self._oscillators[osc_ca1]['adsr']
-
-        w2 = self._oscillators[osc_ca2]['waveshape']
-        f2 = self._oscillators[osc_ca2]['frequency'] * 100 + self._oscillators[osc_ca2]['freq_decimal']
-        b2 = self._oscillators[osc_ca2]['feedback']
-        a2 = self.operator_output_level(osc_ca2, phase, True)
-        t2 = self._oscillators[osc_ca2]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+        except Exception as e:
+#            print('ALGORITHM GRAPH EXCEPTION:', graph, e)
+            return None
 
-        # Without feedback3
-        if b3 <= 0:
-            wave3 = self.waveshape(w3, t3, a3, f3)
-            
-        # With feedback3
-        else:
-            base_shape = self.waveshape(w3, t3, b3, f3)
-            wave3 = self.waveshape(w3, t3, a3, f3, base_shape)
+    # Load the user algorithms in the algorithms file
+    #   [..., {'name': 'N:name', 'chart': [7 lines], 'graph': {'feedback': [ops], 'modulation': {'op': [ops]}, 'outputs': [ops]}}]
+    #   Graphs for the built-in algorithms are ignored.
+    def load_algorithms(self):
+        try:
+            with open('/sd/SYNTH/SYSTEM/algorithms.json', 'r') as f:
+                file_data = json.load(f)
+                f.close()
 
-        # Without feedback1
-        if b1 <= 0:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0)
-            
-        # With feedback1
-        else:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0, b1)
+            for algorithm in list(range(len(FM_Waveshape_class.ALGORITHMS), len(file_data))):
+                dataset = file_data[algorithm]
+                if isinstance(dataset, dict) and 'graph' in dataset.keys():
+                    graph = self.make_graph(dataset['graph'])
+                    if graph is not None:
+                        self._algorithm.append(graph)
+                        SynthIO_class.VIEW_ALGORITHM.append(dataset['name'] if 'name' in dataset.keys() else str(algorithm))
 
-        # Without feedback2
-        if b2 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave0)
-            
-        # With feedback1
-        else:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave0, b2)
-        
-        wave = np.array(wave1 + wave2 + wave3)
-        return wave
+        except Exception as e:
+#            print('SD LOAD ALGORITHMS EXCEPTION:', e)
+            pass
 
-    # FM ALGORITHM-9: <1>-->(2-->3+4)-->
-    def fm_algorithm9(self, osc_ma, osc_mb, osc_ca, osc_cb, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_mb]['waveshape']
-        f1 = self._oscillators[osc_mb]['frequency'] * 100 + self._oscillators[osc_mb]['freq_decimal']
-        b1 = self._oscillators[osc_mb]['feedback']
-        a1 = self.operator_output_level(osc_mb, phase)
-        t1 = self._oscillators[osc_mb]['adsr']
-
-        w2 = self._oscillators[osc_ca]['waveshape']
-        f2 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b2 = self._oscillators[osc_ca]['feedback']
-        a2 = self.operator_output_level(osc_ca, phase, True)
-        t2 = self._oscillators[osc_ca]['adsr']
-
-        w3 = self._oscillators[osc_cb]['waveshape']
-        f3 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b3 = self._oscillators[osc_cb]['feedback']
-        a3 = self.operator_output_level(osc_cb, phase, True)
-        t3 = self._oscillators[osc_cb]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
+        return len(self._algorithm)
+
+    # Generate the waves of the phases with an operator graph (generator yielding after each operator)
+    #   Returns the waves (phases x SAMPLE_SIZE), or a wave (SAMPLE_SIZE) for the same waves in all phases.
+    #   Muted or zero level operators are never generated, they are same as no modulation or no output.
+    #   scale: modulator level scale for the operators modulating the others only
+    def fm_graph(self, graph, phases, scale=1.0):
+        waves = {}
+        keys = {}
+        for op in graph['order']:
+            levels = []
+            for phase in phases:
+                levels.append(self.operator_output_level(op, phase, op in graph['outputs']) * (scale if op not in graph['outputs'] else 1.0))
+                
+            if levels.count(0.0) == len(levels):
+                continue
             
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+            level = self.phase_levels(levels)
+            oscillator = self._oscillators[op]
+            w = oscillator['waveshape']
+            b = oscillator['feedback']
+            f = oscillator['frequency'] * 100 + oscillator['freq_decimal']
+            t = oscillator['adsr']
+
+            # Modulated by the other operators (the feedback is the modulator phase shift)
+            modulators = []
+            mod_keys = []
+            for m in graph['modulation'].get(op, ()):
+                if m in waves:
+                    modulators.append(waves[m])
+                    mod_keys.append(keys[m])
+
+            if len(modulators) > 0:
+                keys[op] = self.operator_key(w, level, f, self.mix_key(mod_keys), b)
+                waves[op] = self.waveshape(w, t, level, f, self.mix_waves(modulators, mod_keys), b, keys[op])
+
+            # With self feedback
+            elif b > 0 and op in graph['feedback'] and op not in graph['modulation']:
+                feedback_key = self.operator_key(w, b, f)
+                keys[op] = self.operator_key(w, level, f, feedback_key)
+                waves[op] = self.waveshape(w, t, level, f, self.waveshape(w, t, b, f, None, None, feedback_key), None, keys[op])
+
+            # Without modulation
+            else:
+                keys[op] = self.operator_key(w, level, f)
+                waves[op] = self.waveshape(w, t, level, f, None, None, keys[op])
 
-        # Without feedback1
-        if b1 <= 0:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0)
-            
-        # With feedback0
-        else:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0, b1)
+            yield
 
-        # Without feedback2
-        if b2 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave1)
-            
-        # With feedback1
-        else:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave1, b2)
+        # Mix the outputs
+        outputs = []
+        out_keys = []
+        for op in graph['outputs']:
+            if op in waves:
+                outputs.append(waves[op])
+                out_keys.append(keys[op])
 
-        # Without feedback3
-        if b3 <= 0:
-            wave3 = self.waveshape(w3, t3, a3, f3, wave0)
-            
-        # With feedback3
-        else:
-            wave3 = self.waveshape(w3, t3, a3, f3, wave0, b3)
-        
-        wave = np.array(wave2 + wave3)
-        return wave
+        if len(outputs) == 0:
+            return np.zeros(FM_Waveshape_class.SAMPLE_SIZE, dtype=np.int16)
 
-    # FM ALGORITHM-10: <1>-->(2+3+4)-->
-    def fm_algorithm10(self, osc_ma, osc_ca, osc_cb, osc_cc, phase=0):
-        w0 = self._oscillators[osc_ma]['waveshape']
-        f0 = self._oscillators[osc_ma]['frequency'] * 100 + self._oscillators[osc_ma]['freq_decimal']
-        b0 = self._oscillators[osc_ma]['feedback']
-        a0 = self.operator_output_level(osc_ma, phase)
-        t0 = self._oscillators[osc_ma]['adsr']
-
-        w1 = self._oscillators[osc_ca]['waveshape']
-        f1 = self._oscillators[osc_ca]['frequency'] * 100 + self._oscillators[osc_ca]['freq_decimal']
-        b1 = self._oscillators[osc_ca]['feedback']
-        a1 = self.operator_output_level(osc_ca, phase, True)
-        t1 = self._oscillators[osc_ca]['adsr']
-
-        w2 = self._oscillators[osc_cb]['waveshape']
-        f2 = self._oscillators[osc_cb]['frequency'] * 100 + self._oscillators[osc_cb]['freq_decimal']
-        b2 = self._oscillators[osc_cb]['feedback']
-        a2 = self.operator_output_level(osc_cb, phase, True)
-        t2 = self._oscillators[osc_cb]['adsr']
-
-        w3 = self._oscillators[osc_cc]['waveshape']
-        f3 = self._oscillators[osc_cc]['frequency'] * 100 + self._oscillators[osc_cc]['freq_decimal']
-        b3 = self._oscillators[osc_cc]['feedback']
-        a3 = self.operator_output_level(osc_cc, phase, True)
-        t3 = self._oscillators[osc_cc]['adsr']
-
-        # Without feedback0
-        if b0 <= 0:
-            wave0 = self.waveshape(w0, t0, a0, f0)
-            
-        # With feedback0
-        else:
-            base_shape = self.waveshape(w0, t0, b0, f0)
-            wave0 = self.waveshape(w0, t0, a0, f0, base_shape)
+        return self.mix_waves(outputs, out_keys, True)
 
-        # Without feedback1
-        if b1 <= 0:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0)
-            
-        # With feedback0
-        else:
-            wave1 = self.waveshape(w1, t1, a1, f1, wave0, b1)
+    # Set and get the harmonic limit of the analytic FM synthesis (0: off, limited under the Nyquist frequency of the wave table)
+    def analytic_harmonics(self, harmonics=None):
+        if harmonics is not None:
+            self._analytic_harmonics = max(0, int(harmonics))
 
-        # Without feedback2
-        if b2 <= 0:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave0)
-            
-        # With feedback1
-        else:
-            wave2 = self.waveshape(w2, t2, a2, f2, wave0, b2)
+        return self._analytic_harmonics
 
-        # Without feedback3
-        if b3 <= 0:
-            wave3 = self.waveshape(w3, t3, a3, f3, wave0)
-            
-        # With feedback3
-        else:
-            wave3 = self.waveshape(w3, t3, a3, f3, wave0, b3)
-        
-        wave = np.array(wave1 + wave2 + wave3)
-        return wave
+    # Bessel functions of the first kind J0(x)..Jn(x) (Miller's backward recurrence)
+    @staticmethod
+    def bessel(n_max, x):
+        if x == 0.0:
+            return [1.0] + [0.0] * n_max
+
+        start = (n_max + int(x) + 16) // 2 * 2
+        jn = [0.0] * (start + 2)
+        jn[start] = 1.0e-20
+        for k in list(range(start, 0, -1)):
+            jn[k - 1] = 2.0 * k / x * jn[k] - jn[k + 1]
+
+            # Keep the values in the single precision float
+            if abs(jn[k - 1]) > 1.0e10:
+                for m in list(range(k - 1, start + 1)):
+                    jn[m] *= 1.0e-10
+
+        # J0 + 2 * (J2 + J4 + ...) = 1
+        norm = jn[0]
+        for k in list(range(2, start + 1, 2)):
+            norm += 2.0 * jn[k]
+
+        return [v / norm for v in jn[:n_max + 1]]
+
+    # Check an operator graph for the analytic FM synthesis
+    #   All operators generated must be the sine waves of the integer frequencies.
+    def analytic_graph(self, graph):
+        for op in graph['order']:
+            oscillator = self._oscillators[op]
+            if oscillator['muted'] == 0 and oscillator['amplitude'] > 0:
+                if oscillator['waveshape'] != FM_Waveshape_class.WAVE_SINE or oscillator['freq_decimal'] != 0:
+                    return False
+
+        return True
+
+    # Spectrum of a sine operator modulated by a spectrum
+    #   Spectrum: {harmonic: [sine level, cosine level]}, harmonic 0 is the cosine level only (DC).
+    #   sin(f t + sum(A sin(k t + p))) = Im(exp(i f t) * product(sum(Jn(A) exp(i n (k t + p)))))
+    #   The sidebands over the harmonic limit are truncated.
+    #   Returns None if the calculation is too large.
+    def analytic_operator(self, level, frequency, modulator, harmonics):
+        products = {0: [1.0, 0.0]}
+        cost = 0
+        if modulator is not None:
+            # Constant phase offset (DC of the modulator)
+            if 0 in modulator:
+                products = {0: [math.cos(modulator[0][1]), math.sin(modulator[0][1])]}
+
+            for k in modulator.keys():
+                amp = math.sqrt(modulator[k][0] * modulator[k][0] + modulator[k][1] * modulator[k][1])
+                if k == 0 or amp < FM_Waveshape_class.ANALYTIC_LEVEL_MIN:
+                    continue
+
+                # Phase of the partial (A sin(k t + p) = a sin(k t) + b cos(k t))
+                p = math.atan2(modulator[k][1], modulator[k][0])
+                n_max = min(int(amp) + 12, harmonics * 2 // k + 1)
+                jn = FM_Waveshape_class.bessel(n_max, amp)
+                while n_max > 0 and abs(jn[n_max]) < FM_Waveshape_class.ANALYTIC_BESSEL_MIN:
+                    n_max -= 1
+
+                cost += len(products) * (n_max * 2 + 1)
+                if cost > FM_Waveshape_class.ANALYTIC_COST_MAX:
+                    return None
+
+                sidebands = {}
+                for n in list(range(-n_max, n_max + 1)):
+                    jv = jn[abs(n)] if n >= 0 or n % 2 == 0 else -jn[abs(n)]
+                    if abs(jv) < FM_Waveshape_class.ANALYTIC_BESSEL_MIN:
+                        continue
+
+                    cr = jv * math.cos(n * p)
+                    ci = jv * math.sin(n * p)
+                    for q in products.keys():
+                        q2 = q + n * k
+                        if abs(frequency + q2) > harmonics:
+                            continue
+
+                        re, im = products[q]
+                        if q2 in sidebands:
+                            sidebands[q2][0] += re * cr - im * ci
+                            sidebands[q2][1] += re * ci + im * cr
+                        else:
+                            sidebands[q2] = [re * cr - im * ci, re * ci + im * cr]
+
+                products = sidebands
+
+        # Im((re + i im) exp(i h t)) = re sin(h t) + im cos(h t), folded into the positive harmonics
+        spectrum = {}
+        for q in products.keys():
+            h = frequency + q
+            sl = products[q][0] * level
+            cl = products[q][1] * level
+            if h < 0:
+                h = -h
+                sl = -sl
+
+            if h == 0:
+                sl = 0.0
+
+            if h in spectrum:
+                spectrum[h][0] += sl
+                spectrum[h][1] += cl
+            else:
+                spectrum[h] = [sl, cl]
+
+        return spectrum
+
+    # Mix spectrums
+    def analytic_mix(self, spectrums):
+        mixed = {}
+        for spectrum in spectrums:
+            for h in spectrum.keys():
+                if h in mixed:
+                    mixed[h][0] += spectrum[h][0]
+                    mixed[h][1] += spectrum[h][1]
+                else:
+                    mixed[h] = [spectrum[h][0], spectrum[h][1]]
+
+        return mixed
+
+    # Shift a spectrum in samples (same as np.roll() of the wave)
+    def analytic_shift(self, spectrum, shifter):
+        shifted = {}
+        for h in spectrum.keys():
+            delta = FM_Waveshape_class.PI2 * h * shifter / FM_Waveshape_class.SAMPLE_SIZE
+            sl, cl = spectrum[h]
+            shifted[h] = [sl * math.cos(delta) + cl * math.sin(delta), cl * math.cos(delta) - sl * math.sin(delta)]
+
+        return shifted
+
+    # Peak level of a spectrum (the sum of the partial levels)
+    def analytic_peak(self, spectrum):
+        peak = 0.0
+        for h in spectrum.keys():
+            peak += math.sqrt(spectrum[h][0] * spectrum[h][0] + spectrum[h][1] * spectrum[h][1])
+
+        return peak
+
+    # Generate the waves of the phases of a sine operator graph in the frequency domain (generator yielding after each phase)
+    #   The spectrum of each operator is calculated with the Bessel functions of the modulation index,
+    #   then the wave is made with an inverse FFT, so the wave is band-limited under the harmonic limit.
+    #   Returns the waves same as fm_graph(), or None if the analytic synthesis is off or not for the graph.
+    def fm_graph_analytic(self, graph, phases, scale=1.0):
+        if self._analytic_harmonics <= 0 or not self.analytic_graph(graph):
+            return None
+
+        harmonics = min(FM_Waveshape_class.SAMPLE_SIZE // 2 - 1, self._analytic_harmonics)
+
+        # Operator levels in the phases
+        levels = {}
+        vary = False
+        for op in graph['order']:
+            levels[op] = []
+            for phase in phases:
+                levels[op].append(self.operator_output_level(op, phase, op in graph['outputs']) * (scale if op not in graph['outputs'] else 1.0))
+
+            vary = vary or levels[op].count(levels[op][0]) != len(levels[op])
+
+        # Spectrum of the outputs in each phase
+        waves = []
+        for row in list(range(len(phases) if vary else 1)):
+            spectrums = {}
+            for op in graph['order']:
+                level = levels[op][row]
+                if level == 0.0:
+                    continue
+
+                oscillator = self._oscillators[op]
+                b = oscillator['feedback']
+                f = oscillator['frequency']
+
+                # Modulated by the other operators (the feedback is the modulator phase shift)
+                modulators = []
+                for m in graph['modulation'].get(op, ()):
+                    if m in spectrums:
+                        modulators.append(spectrums[m])
+
+                if len(modulators) > 0:
+                    modulator = self.analytic_mix(modulators)
+                    shifter = int(FM_Waveshape_class.SAMPLE_SIZE * b / 255)
+                    if shifter > 0 and shifter < FM_Waveshape_class.SAMPLE_SIZE - 1:
+                        modulator = self.analytic_shift(modulator, shifter)
+
+                # With self feedback
+                elif b > 0 and op in graph['feedback'] and op not in graph['modulation']:
+                    modulator = {f: [float(b), 0.0]}
+
+                # Without modulation
+                else:
+                    modulator = None
+
+                spectrums[op] = self.analytic_operator(level, f, modulator, harmonics)
+                if spectrums[op] is None:
+                    return None
+
+                # The waves over the sample volume are clipped in the wave calculation
+                if self.analytic_peak(spectrums[op]) > FM_Waveshape_class.SAMPLE_VOLUME_f:
+                    return None
+
+            # Inverse FFT of the outputs
+            #   A partial A sin(2pi k t/N) is -A*N/2 in the imaginary part of the bin k and +A*N/2 in the bin N-k,
+            #   B cos(2pi k t/N) is B*N/2 in the real part of the both bins (B*N in the bin 0).
+            outputs = []
+            for op in graph['outputs']:
+                if op in spectrums:
+                    outputs.append(spectrums[op])
+
+            if len(outputs) == 0:
+                return np.zeros(FM_Waveshape_class.SAMPLE_SIZE, dtype=np.int16)
+
+            spectrum = self.analytic_mix(outputs)
+            real = self.scratch('real')
+            imag = self.scratch('imag')
+            real[:] = 0.0
+            imag[:] = 0.0
+            size = FM_Waveshape_class.SAMPLE_SIZE
+            for h in spectrum.keys():
+                if h == 0:
+                    real[0] = spectrum[h][1] * size
+                else:
+                    real[h] = spectrum[h][1] * size / 2
+                    real[size - h] = spectrum[h][1] * size / 2
+                    imag[h] = -spectrum[h][0] * size / 2
+                    imag[size - h] = spectrum[h][0] * size / 2
+
+            waves.append(self.inverse_fft(real, imag))
+            yield
+
+        if len(waves) == 1:
+            return self.fixed_point_wave(waves[0])
+
+        fm_waves = np.zeros((len(waves), FM_Waveshape_class.SAMPLE_SIZE))
+        for row in list(range(len(waves))):
+            fm_waves[row, :] = waves[row]
+
+        return self.fixed_point_wave(fm_waves)
 
     # Addjust the sum of the audio output levels to the maximum volume
     def adjust_output_levels(self, algorithm, audio_output_level_adjust):
-        audio_operators = FM_Waveshape_class.AUDIO_OUTPUT_OPERATOR[algorithm]
+        audio_operators = self._algorithm[algorithm]['levels']
 #        print('AUDIO OPERATORS:', algorithm, audio_operators)
         if audio_output_level_adjust and len(audio_operators) > 0:
             sum_audio_level = 0
@@ -2170,8 +3041,7 @@ class FM_Waveshape_class:
                 sum_audio_level += self._oscillators[osc]['amplitude']
 
             if SynthIO is not None:
-                for osc in list(range(FM_Waveshape_class.SINE_OSCILLATOR_MAX)):
-                    dataset = SynthIO.additivewave_parameter(osc)
+                for dataset in SynthIO.additivewave_parameter():
                     sum_audio_level += dataset['amplitude']
 
             self._adjust_output_level = 1.0 if sum_audio_level == 0 else (255.0 / sum_audio_level)
@@ -2180,65 +3050,300 @@ class FM_Waveshape_class:
         else:
             self._adjust_output_level = 1.0
 
-    # Make a waveshape of an algorithm
-    #  phase: 0=ATTACK, 1=DECAY, 2=SUSTAIN
-    def fm_algorithm(self, algorithm, audio_output_level_adjust = True, phase=0):
+    # Wave shape envelope factor of the additive synthsis in a phase
+    def additive_factor(self, operator, phase=0):
+        if   phase == 1:
+            return (operator['decay_additive'] - operator['attack_additive']) / 3 + operator['attack_additive']
+        
+        elif phase == 2:
+            return (operator['decay_additive'] - operator['attack_additive']) / 3 * 2 + operator['attack_additive']
+
+        elif phase == 3:
+            return operator['decay_additive']
+
+        elif phase == 4:
+            return (operator['sustain_additive'] - operator['decay_additive']) / 3 + operator['decay_additive']
+
+        elif phase == 5:
+            return (operator['sustain_additive'] - operator['decay_additive']) / 3 * 2 + operator['decay_additive']
+            
+        elif phase == 6:
+            return operator['sustain_additive']
+        
+        return operator['attack_factor']
+
+    # Make the additive waves of the phases
+    #   Returns the waves (phases x SAMPLE_SIZE), a wave (SAMPLE_SIZE) for the same waves in all phases, or 0.0 for no wave.
+    #   The integer partials are placed in a spectrum and synthesized with an inverse FFT for each phase,
+    #   so the cost does not depend on the number of partials.
+    #   The non-integer partials are added with the sine wave basis cycles cached.
+    def additive_wave(self, phases):
+        wave = 0.0
+        if SynthIO is None:
+            return wave
+
+        spectrum = {}
+        vary = False
+        for dataset in SynthIO.additivewave_parameter():
+            if dataset['amplitude'] > 0 and dataset['muted'] == 0:
+                oscillator = dataset['oscillator']
+                amp = self.operator_level(dataset['amplitude'], True) / FM_Waveshape_class.SAMPLE_VOLUME_f * FM_Waveshape_class.SAMPLE_VOLUME
+                
+                # Wave shape envelope for the additive synthsis works every two oscillators
+                operator = SynthIO.wave_parameter((oscillator % FM_Waveshape_class.SINE_OSCILLATOR_MAX) // 2)
+                levels = []
+                for phase in phases:
+                    levels.append(amp * self.additive_factor(operator, phase))
+
+                level = self.phase_levels(levels)
+                vary = vary or isinstance(level, np.ndarray)
+#                print('ADD WAVE', oscillator, dataset, amp)
+
+                # Integer partial: sum up in the spectrum
+                partial = dataset['frequency']
+                if dataset['freq_decimal'] == 0 and partial < FM_Waveshape_class.SAMPLE_SIZE // 2:
+                    if partial in spectrum:
+                        for phase in list(range(len(levels))):
+                            spectrum[partial][phase] += levels[phase]
+
+                    else:
+                        spectrum[partial] = levels
+
+                # Non-integer partial: sine wave basis
+                else:
+                    wave = self.base_cycle(FM_Waveshape_class.WAVE_SINE, partial + dataset['freq_decimal'] / 100) * level + wave
+
+        if len(spectrum) == 0:
+            return wave
+
+        # Inverse FFT of the spectrum in each phase (only once for the same spectrums in all phases)
+        #   A partial sin(2pi k t/N) * A is -A*N/2 in the imaginary part of the bin k and +A*N/2 in the bin N-k.
+        waves = []
+        for row in list(range(len(phases) if vary else 1)):
+            real = self.scratch('real')
+            imag = self.scratch('imag')
+            real[:] = 0.0
+            imag[:] = 0.0
+            for partial in spectrum.keys():
+                bin_level = spectrum[partial][row] * FM_Waveshape_class.SAMPLE_SIZE / 2
+                imag[partial] = -bin_level
+                imag[FM_Waveshape_class.SAMPLE_SIZE - partial] = bin_level
+
+            waves.append(self.inverse_fft(real, imag))
+
+        if len(waves) == 1:
+            return waves[0] + wave
+
+        spectrum_waves = np.zeros((len(waves), FM_Waveshape_class.SAMPLE_SIZE))
+        for phase in list(range(len(waves))):
+            spectrum_waves[phase, :] = waves[phase]
+
+        return spectrum_waves + wave
+
+    # FFT of a real wave, returns (real, imaginary)
+    #   ulab without the complex numbers returns a tuple (real, imaginary).
+    def forward_fft(self, wave):
+        spectrum = np.fft.fft(np.array(wave, dtype=np.float))
+        if isinstance(spectrum, tuple):
+            return spectrum
+
+        return (np.real(spectrum), np.imag(spectrum))
+
+    # Real part of an inverse FFT
+    #   ulab without the complex numbers returns a tuple (real, imaginary).
+    def inverse_fft(self, real, imag):
+        wave = np.fft.ifft(real, imag)
+        if isinstance(wave, tuple):
+            return wave[0]
+
+        return np.real(wave)
+
+    # Find the distinct phases having different operator levels or additive factors
+    #   Returns (distinct phases, phase map), the phase map has an index in the distinct phases for each phase.
+    #   The phases having the same parameters share a wave table, it is generated only once.
+    def distinct_phases(self):
+        phases = []
+        phase_keys = []
+        phase_map = []
+        for phase in list(range(FM_Waveshape_class.ENVELOPE_PHASES)):
+            key = []
+            for op in list(range(FM_Waveshape_class.OPERATOR_MAX)):
+                key.append(self.operator_output_level(op, phase))
+
+                # Additive wave envelopes (every two sine oscillators)
+                if SynthIO is not None and op < FM_Waveshape_class.SINE_OSCILLATOR_MAX // 2:
+                    key.append(self.additive_factor(SynthIO.wave_parameter(op), phase))
+
+            key = tuple(key)
+            if key in phase_keys:
+                phase_map.append(phase_keys.index(key))
+            else:
+                phase_keys.append(key)
+                phases.append(phase)
+                phase_map.append(len(phases) - 1)
+
+#        print('DISTINCT PHASES:', phases, phase_map)
+        return (phases, phase_map)
+
+    # Make the waveshapes of an algorithm for all phases at once
+    #  phases: 0=ATTACK, 1,2=ATTACK-->DECAY, 3=DECAY, 4,5=DECAY-->SUSTAIN, 6=SUSTAIN
+    #  Returns a list of the int16 wave tables for the phases (the phases with the same parameters share a table).
+    def fm_algorithm_phases(self, algorithm, audio_output_level_adjust = True):
+        return FM_Waveshape_class.run_steps(self.fm_algorithm_steps(algorithm, audio_output_level_adjust))
+
+    # Make the waveshapes of an algorithm for all phases step by step (generator yielding after each operator)
+    #  Returns a list of the int16 wave tables for the phases as the generator's return value.
+    #  Only the waves invalidated (see invalidate_waves()) are regenerated,
+    #  the FM waves and the additive waves are kept separately.
+    #  scale: modulator level scale (for the key zones and the velocity layers), the wave tables are kept for each scale.
+    #  The FM waves are kept only for the scale 1.0 to remake its wave tables after editing the additive waves,
+    #  the other scales keep the int16 wave tables only.
+    def fm_algorithm_steps(self, algorithm, audio_output_level_adjust = True, scale=1.0):
         if algorithm >= 0 and algorithm < len(self._algorithm):
             # Addjust the sum of the audio output levels to the maximum volume
             self.adjust_output_levels(algorithm, audio_output_level_adjust)
             
             # Generate wave with the algorithm
             if self._algorithm[algorithm] is not None:
-                algo = self._algorithm[algorithm]
-#                print('fm_algorithm:', algorithm, audio_output_level_adjust, phase)
-                wave = algo[0](*algo[1], phase)
+                phases, phase_map = self.distinct_phases()
+                
+                # All waves depend on the algorithm, the output level, the distinct phases and the harmonic limit
+                condition = (algorithm, self._adjust_output_level, tuple(phases), tuple(phase_map), self._analytic_harmonics)
+                if self._wave_condition != condition:
+                    self._wave_condition = condition
+                    self.invalidate_waves()
+
+                # Nothing changed
+                if scale in self._wave_tables:
+                    return self._wave_tables[scale]
+
+                # FM waves
+                serial = self._wave_serial
+                fm_waves = self._fm_waves.get(scale)
+                if fm_waves is None:
+#                    print('fm_algorithm:', algorithm, audio_output_level_adjust, scale)
+                    fm_waves = yield from self.fm_graph_analytic(self._algorithm[algorithm], phases, scale)
+                    if fm_waves is None:
+                        fm_waves = yield from self.fm_graph(self._algorithm[algorithm], phases, scale)
 
                 # Additive waves
-                if SynthIO is not None:
-                    for oscillator in list(range(FM_Waveshape_class.SINE_OSCILLATOR_MAX)):
-                        dataset = SynthIO.additivewave_parameter(oscillator)
-                        if dataset['amplitude'] > 0:
-                            amp = self.operator_level(dataset['amplitude'] * (0 if dataset['muted'] == 1 else 1), True)
-                            
-                            # Wave shape envelope for the additive synthsis works every two oscillators
-                            operator = SynthIO.wave_parameter(oscillator//2)
-                            if   phase == 1:
-                                factor = (operator['decay_additive'] - operator['attack_additive']) / 3 + operator['attack_additive']
-                            
-                            elif phase == 2:
-                                factor = (operator['decay_additive'] - operator['attack_additive']) / 3 * 2 + operator['attack_additive']
-
-                            elif phase == 3:
-                                factor = operator['decay_additive']
+                additive_waves = self._additive_waves
+                if additive_waves is None:
+                    additive_waves = self.additive_wave(phases)
+                    yield
+
+                # Compress in the sample volume (the int16 waves are added in float in the scratch array)
+                if isinstance(additive_waves, float) or len(additive_waves.shape) <= len(fm_waves.shape):
+                    wave = self.scratch_rows(fm_waves.shape)
+                    wave[:] = fm_waves
+                    wave += additive_waves
+                else:
+                    wave = self.scratch_rows(additive_waves.shape)
+                    wave[:] = additive_waves
+                    wave += fm_waves
+#                print('MODUL:', wave)
+                wave = self.clip_wave(wave, FM_Waveshape_class.SAMPLE_VOLUME_f)
+                
+                # Wave table for each distinct phase
+                tables = []
+                for row in list(range(1 if len(wave.shape) == 1 else len(phases))):
+                    tables.append(np.array(wave if len(wave.shape) == 1 else wave[row], dtype=np.int16))
 
-                            elif phase == 4:
-                                factor = (operator['sustain_additive'] - operator['decay_additive']) / 3 + operator['decay_additive']
+                # The phases share the tables
+                wave_tables = []
+                for phase in list(range(FM_Waveshape_class.ENVELOPE_PHASES)):
+                    wave_tables.append(tables[0 if len(tables) == 1 else phase_map[phase]])
 
-                            elif phase == 5:
-                                factor = (operator['sustain_additive'] - operator['decay_additive']) / 3 * 2 + operator['decay_additive']
-                                
-                            elif phase == 6:
-                                factor = operator['sustain_additive']
-                            
-                            else:
-                                factor = operator['attack_factor']
+                # Keep the waves unless they have been invalidated while generating
+                if serial == self._wave_serial:
+                    if scale == 1.0:
+                        self._fm_waves[scale] = fm_waves
 
-#                            print('ADD WAVE', oscillator, dataset, amp)
-                            addwave = self.wave_sine(None, amp * factor, dataset['frequency'] + dataset['freq_decimal'] / 100)
-#                            print('ADDED:', len(addwave), addwave)
-#                            print('ORIGI:', wave)
-                            wave = np.array(wave + addwave)
-#                            print('MODUL:', wave)
+                    self._additive_waves     = additive_waves
+                    self._wave_tables[scale] = wave_tables
 
-                # Compress in the sample volume
-                wave = np.where(wave >  FM_Waveshape_class.SAMPLE_VOLUME_f,  FM_Waveshape_class.SAMPLE_VOLUME, wave)
-                wave = np.where(wave < -FM_Waveshape_class.SAMPLE_VOLUME_f, -FM_Waveshape_class.SAMPLE_VOLUME, wave)
-                return np.array(wave, dtype=np.int16)
+                return wave_tables
 
         # Default wave shape is sine
         wave = np.array(np.sin(np.linspace(0, FM_Waveshape_class.PI2, FM_Waveshape_class.SAMPLE_SIZE, endpoint=False)) * FM_Waveshape_class.SAMPLE_VOLUME, dtype=np.int16)
-        return wave
-        
+        return [wave] * FM_Waveshape_class.ENVELOPE_PHASES
+
+    # Run a generator to the end, then returns the generator's return value
+    @staticmethod
+    def run_steps(steps):
+        try:
+            while True:
+                next(steps)
+
+        except StopIteration as e:
+            return e.args[0] if len(e.args) > 0 else None
+
+    # Make a waveshape of an algorithm in a phase
+    def fm_algorithm(self, algorithm, audio_output_level_adjust = True, phase=0):
+        return self.fm_algorithm_phases(algorithm, audio_output_level_adjust)[phase]
+
+    # Size of a band-limited wave table having the harmonics (up to the wave table size)
+    #   The smallest power of 2 over the harmonics x 2, at least MIPMAP_SIZE.
+    def mipmap_size(self, size, harmonics):
+        mipmap_size = FM_Waveshape_class.MIPMAP_SIZE
+        while mipmap_size <= harmonics * 2:
+            mipmap_size *= 2
+
+        return min(size, mipmap_size)
+
+    # Maximum bytes of the band-limited wave tables made for a wave table of a size
+    def mipmap_bytes(self, size):
+        mipmap_bytes = 0
+        for harmonics in self._mipmap_harmonics:
+            if harmonics < size // 2:
+                mipmap_bytes += self.mipmap_size(size, harmonics) * 2
+
+        return mipmap_bytes
+
+    # Make the band-limited wave tables of a wave table for the MIDI notes
+    #   Returns a list of the wave tables for the note numbers 0..127.
+    #   The harmonics over the Nyquist frequency of each octave are removed by the FFT truncation.
+    #   The same wave table is shared with the octaves having no harmonics to remove.
+    #   A band-limited wave table is made in mipmap_size(), smaller than a large wave table.
+    def mipmap(self, wave_table):
+        size = len(wave_table)
+        real, imag = self.forward_fft(wave_table)
+        threshold = FM_Waveshape_class.MIPMAP_THRESHOLD * size / 2
+        octave_tables = []
+        table = wave_table
+        for octave in list(range(FM_Waveshape_class.MIPMAP_OCTAVES)):
+            harmonics = self._mipmap_harmonics[octave]
+            if harmonics < size // 2:
+                # Harmonics to remove
+                if self.peak(real[harmonics + 1:size - harmonics]) + self.peak(imag[harmonics + 1:size - harmonics]) >= threshold:
+                    real[harmonics + 1:size - harmonics] = 0.0
+                    imag[harmonics + 1:size - harmonics] = 0.0
+                    mipmap_size = self.mipmap_size(size, harmonics)
+                    if mipmap_size == size:
+                        wave = self.inverse_fft(real, imag)
+
+                    # The harmonics in a smaller spectrum
+                    else:
+                        mipmap_real = np.zeros(mipmap_size)
+                        mipmap_imag = np.zeros(mipmap_size)
+                        mipmap_real[:harmonics + 1] = real[:harmonics + 1]
+                        mipmap_imag[:harmonics + 1] = imag[:harmonics + 1]
+                        mipmap_real[mipmap_size - harmonics:] = real[size - harmonics:]
+                        mipmap_imag[mipmap_size - harmonics:] = imag[size - harmonics:]
+                        wave = self.inverse_fft(mipmap_real, mipmap_imag)
+                        wave *= mipmap_size / size
+
+                    wave = self.clip_wave(wave, FM_Waveshape_class.SAMPLE_VOLUME_f)
+                    table = np.array(wave, dtype=np.int16)
+
+            octave_tables.append(table)
+
+        tables = []
+        for note in list(range(128)):
+            tables.append(octave_tables[note // 12])
+
+        return tables
+
 ################# End of FM Waveshape Class Definition #################
 
 
@@ -2254,6 +3359,21 @@ class SynthIO_class:
     # Synthesize voices
     MAX_VOICES = 12
 
+    # Memory budget for the wave tables of all key zones and velocity layers (bytes)
+    WAVE_TABLE_MEMORY = 96 * 1024
+
+    # Free memory kept for the other tasks while making the wave tables (bytes)
+    MEMORY_RESERVE = 16 * 1024
+
+    # Voice modes
+    VOICE_TABLE = 0		# Wave tables along the envelope phases
+    VOICE_RING  = 1		# 2 operators FM voice played with the ring modulation in synthio
+
+    # Voice stealing policies over the max voices
+    STEAL_OLDEST   = 0		# The oldest voice (the smallest age)
+    STEAL_QUIETEST = 1		# The voice with the lowest envelope level
+    STEAL_RELEASED = 2		# The released voice with the lowest envelope level, otherwise the oldest voice
+
     # Fileters
     FILTER_PASS       = 0
     FILTER_LPF        = 1
@@ -2278,6 +3398,8 @@ class SynthIO_class:
     # View management
     VIEW_OFF_ON = ['OFF', 'ON']
     VIEW_OFF_ON_MODULATION = ['OFF', 'ON', 'MODLT']
+    VIEW_VOICE_MODE = ['TABLE', 'RING']
+    VIEW_VOICE_STEAL = ['OLDEST', 'QUIETEST', 'RELEASED']
     VIEW_ALGORITHM = ['0:<1>*2', '1:<1>+2', '2:<1>+2+<3>+4', '3:(<1>+<2>*3)*4', '4:<1>*2*3*4', '5:<1>*2+<3>*4', '6:<1>+<2>*3*4', '7:<1>+<2>*3+<4>', '8:<1>*(2+3)+<4>', '9:<1>*(2*3+4)', '10:<1>*(2+3+4)']
     VIEW_WAVE = ['Sin', 'Saw', 'Tri', 'Sqr', 'aSi', '+Si', 'Noi', 'WV1', 'WV2', 'WV3', 'WV4']
 #    VIEW_FILTER = ['PASS', 'LPF', 'HPF', 'BPF', 'NOTCH', 'LOW SHELF', 'HIGH SHELF', 'PEAKING EQ']
@@ -2345,6 +3467,13 @@ class SynthIO_class:
                 'ADJUST_LEVEL': {'TYPE': SynthIO_class.TYPE_INDEX,  'MIN':     0, 'MAX':    1, 'VIEW': SynthIO_class.VIEW_OFF_ON},
                 'PITCH_BEND'  : {'TYPE': SynthIO_class.TYPE_INT,    'MIN':     0, 'MAX':   12, 'VIEW': '{:1d}'},
                 'PORTAMENT'   : {'TYPE': SynthIO_class.TYPE_FLOAT,  'MIN': -5.00, 'MAX': 5.00, 'VIEW': '{:+6.3f}'},
+                'TABLE_SIZE'  : {'TYPE': SynthIO_class.TYPE_INDEXED_VALUE, 'MIN': 0, 'MAX': len(FM_Waveshape_class.SAMPLE_SIZES) - 1, 'VIEW': FM_Waveshape_class.SAMPLE_SIZES},
+                'KEY_ZONE_WIDTH': {'TYPE': SynthIO_class.TYPE_INT,  'MIN':     1, 'MAX':  127, 'VIEW': '{:3d}'},
+                'VELOCITY_LAYERS': {'TYPE': SynthIO_class.TYPE_INT, 'MIN':     1, 'MAX':    8, 'VIEW': '{:1d}'},
+                'VELOCITY_SCALE': {'TYPE': SynthIO_class.TYPE_FLOAT, 'MIN':  0.00, 'MAX': 2.00, 'VIEW': '{:4.2f}'},
+                'FM_HARMONICS': {'TYPE': SynthIO_class.TYPE_INT,    'MIN':     0, 'MAX': 1023, 'VIEW': '{:4d}'},
+                'VOICE_MODE'  : {'TYPE': SynthIO_class.TYPE_INDEX,  'MIN':     0, 'MAX':    1, 'VIEW': SynthIO_class.VIEW_VOICE_MODE},
+                'VOICE_STEAL' : {'TYPE': SynthIO_class.TYPE_INDEX,  'MIN':     0, 'MAX':    2, 'VIEW': SynthIO_class.VIEW_VOICE_STEAL},
                 'CURSOR'      : {'TYPE': SynthIO_class.TYPE_INDEX,  'MIN':     0, 'MAX': len(SynthIO_class.VIEW_CURSOR_f6) - 1, 'VIEW': SynthIO_class.VIEW_CURSOR_f6}
             },
             
@@ -2444,11 +3573,20 @@ class SynthIO_class:
 
         # synthio related objects for internal use
         self._wave_shape     = [None, None, None, None, None, None, None]
+        self._wave_mipmaps   = [None, None, None, None, None, None, None]
+        self._zone_waves     = {}		# {modulator level scale: (wave tables, band-limited wave tables)} for the key zones and the velocity layers
+        self._layer_mipmaps  = [self._wave_mipmaps]	# Band-limited wave tables for the notes in each velocity layer
+        self._velocity_layers = [0] * 128		# Velocity layer for each velocity
+        self._wave_job       = None		# Wave shape generation job in the background
+        self._ring_voice     = None		# Ring modulation voice parameters (None: wave table voice)
         self._lfo_sound_amp  = None
         self._lfo_sound_bend = None
         self._lfo_filter     = None
-        self.filter_storage  = [None] * SynthIO_class.MAX_VOICES
-#        self.filter_storage  = [None, None, None, None, None, None, None, None, None, None, None, None, None, None, None, None]
+        self.filter_storage  = []		# Filter for each voice (the voice number in MIDI_class)
+        for v in list(range(SynthIO_class.MAX_VOICES)):
+            self.filter_storage.append({'FILTER': None, 'TIME': -1, 'START_TIME': 0, 'VELOCITY': 127, 'NOTE': 0, 'NOTE_FREQUENCY': 0})
+        self._start_filters  = [None] * 128		# Filter cache at note on for each note
+        self._start_filter_params = [None, None, None]	# Filter type, frequency and resonance of the filter cache
         self._filter_adsr    = []
         self._filter_modulation_value = 0
         self._envelope_vca   = None
@@ -2475,6 +3613,14 @@ class SynthIO_class:
                 'ADJUST_LEVEL': 1,
                 'PITCH_BEND'  : 2,
                 'PORTAMENT'   : 0.0,
+                'TABLE_SIZE'  : 512,
+                'KEY_ZONE_WIDTH': 12,
+                'KEY_ZONE_SCALE': [],
+                'VELOCITY_LAYERS': 1,
+                'VELOCITY_SCALE': 0.5,
+                'FM_HARMONICS': 0,
+                'VOICE_MODE'  : 0,
+                'VOICE_STEAL' : 0,
                 'CURSOR'      : 0
             },
             
@@ -2722,6 +3868,21 @@ class SynthIO_class:
                 if osc_num < 0:
                     return dataset
 
+        # Operators only in the sound file (not editable)
+        if osc_num >= FM_Waveshape_class.OPERATOR_EDITABLE and osc_num < FM_Waveshape_class.OPERATOR_MAX:
+            dataset = {
+                'oscillator': osc_num, 'waveshape': 0, 'frequency': 1, 'freq_decimal': 0, 'amplitude': 0, 'feedback': 0,
+                'attack_factor': 1.0, 'attack_additive': 1.0, 'decay_additive': 1.0,
+                'decay_factor': 1.0, 'sustain_additive': 1.0, 'sustain_factor': 1.0,
+                'muted': 0
+            }
+            for parm in params.keys():
+                if parm in dataset.keys():
+                    dataset[parm] = params[parm]
+
+            self._synth_params['OSCILLATORS'].append(dataset)
+            return dataset
+
         return None
 
     # Set / Get ADDITIVEWAVE parameter
@@ -2750,8 +3911,20 @@ class SynthIO_class:
                         if parm in dataset.keys():
                             dataset[parm] = params[parm]
                     
+                    FM_Waveshape.invalidate_waves(False, True)
                     return dataset
 
+        # Partials only in the sound file (not editable)
+        if osc_num >= FM_Waveshape_class.SINE_OSCILLATOR_MAX and osc_num < FM_Waveshape_class.ADDITIVE_PARTIALS_MAX:
+            dataset = {'oscillator': osc_num, 'frequency': osc_num + 1, 'freq_decimal': 0, 'amplitude': 0, 'muted': 0}
+            for parm in params.keys():
+                if parm in dataset.keys():
+                    dataset[parm] = params[parm]
+
+            self._synth_params['ADDITIVEWAVE'].append(dataset)
+            FM_Waveshape.invalidate_waves(False, True)
+            return dataset
+
         return None
 
     # Get parameter in its format
@@ -2809,27 +3982,451 @@ class SynthIO_class:
 
     # Generate a wave shape of the current wave parameters
     def generate_wave_shape(self, audio_output_level_adjust = True):
+        self._wave_job = None
+        return FM_Waveshape_class.run_steps(self.generate_wave_shape_steps(audio_output_level_adjust))
+
+    # Generate a wave shape of the current wave parameters step by step (generator)
+    #   The wave tables are made in a back buffer, then swapped into the current wave shapes at once.
+    #   The notes keep playing with the current wave shapes until the swap.
+    def generate_wave_shape_steps(self, audio_output_level_adjust = True):
         fm_params = self.wave_parameter()
         algo = -1
+        operators = []
         for parm in fm_params:
             if 'algorithm' in parm:
                 algo = parm['algorithm']
                 
             else:
                 FM_Waveshape.oscillator(parm['oscillator'], parm)
+                operators.append(parm['oscillator'])
+
+        # Operators not in the sound are muted
+        for op in list(range(FM_Waveshape_class.OPERATOR_MAX)):
+            if op not in operators:
+                FM_Waveshape.oscillator(op, {'amplitude': 0, 'muted': 1})
+
+        # Ring modulation voice (no wave table generation)
+        ring_voice = None
+        if algo >= 0 and self._synth_params['SOUND']['VOICE_MODE'] == SynthIO_class.VOICE_RING:
+            FM_Waveshape.sample_size(self._synth_params['SOUND']['TABLE_SIZE'])
+            FM_Waveshape.adjust_output_levels(algo, audio_output_level_adjust)
+            ring_voice = self.ring_voice_parameter(algo)
+
+        if ring_voice is not None:
+            carrier = ring_voice['carrier']
+            self._ring_voice      = ring_voice
+            self._wave_shape      = [carrier] * 7
+            self._wave_mipmaps    = [[carrier] * 128] * 7
+            self._layer_mipmaps   = [self._wave_mipmaps]
+            self._velocity_layers = [0] * 128
+            self._zone_waves      = {}
 
         # Make wave shapes along the VCA envelope phases
-        if algo >= 0:
-            for ws in list(range(7)):
-                self._wave_shape[ws] = FM_Waveshape.fm_algorithm(algo, audio_output_level_adjust, ws)
+        elif algo >= 0:
+            FM_Waveshape.sample_size(self._synth_params['SOUND']['TABLE_SIZE'])
+            FM_Waveshape.analytic_harmonics(self._synth_params['SOUND']['FM_HARMONICS'])
+            wave_shape = yield from FM_Waveshape.fm_algorithm_steps(algo, audio_output_level_adjust)
+            wave_mipmaps = yield from self.mipmap_steps(wave_shape, self._zone_waves.get(1.0))
+            zone_waves = {1.0: (wave_shape, wave_mipmaps)}
+
+            # Wave tables of the key zones in the full velocity layer (with the modulator level scales)
+            #   The key zones and the velocity layers are kept in the memory budget (the maximum bytes of a scale).
+            scale_bytes = self.scale_bytes(wave_shape)
+            zone_scales = self.key_zone_scales(scale_bytes)
+            yield from self.zone_waves_steps(algo, audio_output_level_adjust, zone_scales, 1.0, zone_waves)
+
+            # Velocity layers in the rest of the memory budget
+            layer_bytes = scale_bytes * max(1, len(self.distinct_scales(zone_scales)))
+            layer_scales = self.velocity_layer_scales(layer_bytes, SynthIO_class.WAVE_TABLE_MEMORY - self.wave_tables_bytes(zone_waves))
+            for layer_scale in layer_scales[:-1]:
+                yield from self.zone_waves_steps(algo, audio_output_level_adjust, zone_scales, layer_scale, zone_waves)
+
+            # Band-limited wave tables for the notes in each layer
+            layer_mipmaps = []
+            for layer_scale in layer_scales:
+                layer_mipmaps.append(self.notes_mipmaps(zone_scales, layer_scale, zone_waves))
+
+            FM_Waveshape.prune_waves(list(zone_waves.keys()))
+
+            # Swap the back buffer
+            self._ring_voice      = None
+            self._wave_shape      = wave_shape
+            self._wave_mipmaps    = layer_mipmaps[-1]
+            self._layer_mipmaps   = layer_mipmaps
+            self._velocity_layers = self.velocity_layer_indexes(len(layer_mipmaps))
+            self._zone_waves      = zone_waves
 
         return self._wave_shape
 
+    # Make the wave tables of the key zones in a velocity layer step by step (generator)
+    #   The wave tables are added to zone_waves: {modulator level scale: (wave tables, band-limited wave tables)}
+    def zone_waves_steps(self, algo, audio_output_level_adjust, zone_scales, layer_scale, zone_waves):
+        for zone_scale in (zone_scales if len(zone_scales) > 0 else [1.0]):
+            scale = zone_scale * layer_scale
+            if scale not in zone_waves:
+                zone_tables = yield from FM_Waveshape.fm_algorithm_steps(algo, audio_output_level_adjust, scale)
+                zone_mipmaps = yield from self.mipmap_steps(zone_tables, self._zone_waves.get(scale))
+                zone_waves[scale] = (zone_tables, zone_mipmaps)
+
+    # Make the band-limited wave tables for the notes in a velocity layer
+    #   Returns a list of the band-limited wave tables for the note numbers 0..127 in each phase.
+    def notes_mipmaps(self, zone_scales, layer_scale, zone_waves):
+        if len(zone_scales) == 0:
+            return zone_waves[layer_scale][1]
+
+        zone_width = max(1, self._synth_params['SOUND']['KEY_ZONE_WIDTH'])
+        notes_mipmaps = []
+        for ws in list(range(7)):
+            tables = []
+            for note in list(range(128)):
+                tables.append(zone_waves[zone_scales[min(note // zone_width, len(zone_scales) - 1)] * layer_scale][1][ws][note])
+
+            notes_mipmaps.append(tables)
+
+        return notes_mipmaps
+
+    # Bytes of the wave tables and the band-limited wave tables (the tables shared are counted once)
+    def wave_tables_bytes(self, zone_waves):
+        table_ids = {}
+        for scale in zone_waves.keys():
+            wave_tables, wave_mipmaps = zone_waves[scale]
+            for ws in list(range(7)):
+                table_ids[id(wave_tables[ws])] = len(wave_tables[ws])
+                for table in wave_mipmaps[ws]:
+                    table_ids[id(table)] = len(table)
+
+        return sum(table_ids.values()) * 2
+
+    # Maximum bytes of the wave tables and the band-limited wave tables of a modulator level scale
+    #   The scales have the same distinct phases as the wave tables, all octaves may have a band-limited wave table.
+    def scale_bytes(self, wave_tables):
+        table_ids = {}
+        for table in wave_tables:
+            table_ids[id(table)] = len(table) * 2 + FM_Waveshape.mipmap_bytes(len(table))
+
+        return sum(table_ids.values())
+
+    # Modulator level scales of the velocity layers from the lowest velocity (the last one is 1.0 for the full velocity)
+    #   The layers other than the full velocity layer are limited in the free bytes with the bytes of a layer.
+    def velocity_layer_scales(self, layer_bytes, free_bytes):
+        layers = max(1, self._synth_params['SOUND']['VELOCITY_LAYERS'])
+        if layer_bytes > 0:
+            layers = max(1, min(layers, 1 + max(0, free_bytes) // layer_bytes))
+
+        if layers == 1:
+            return [1.0]
+
+        low = float(self._synth_params['SOUND']['VELOCITY_SCALE'])
+        scales = []
+        for layer in list(range(layers)):
+            scales.append(low + (1.0 - low) * layer / (layers - 1))
+
+        scales[-1] = 1.0
+        return scales
+
+    # Velocity layer for each velocity 0..127
+    def velocity_layer_indexes(self, layers):
+        indexes = []
+        for velocity in list(range(128)):
+            indexes.append(velocity * layers // 128)
+
+        return indexes
+
+    # Ring modulation voice of a 2 operators algorithm
+    #   The carrier note plays the carrier wave, the ring modulation note plays the carrier wave multiplied by
+    #   the modulator wave (ring_waveform at ring_frequency), then the sidebands of the modulator level are added
+    #   to the carrier along the modulator envelope in synthio.
+    #   Returns None if the algorithm is not a modulator and a carrier (the other operators muted).
+    def ring_voice_parameter(self, algo):
+        graph = FM_Waveshape._algorithm[algo]
+        if graph is None:
+            return None
+
+        # Operators used
+        operators = []
+        for op in graph['order']:
+            if FM_Waveshape.operator_output_level(op, 0, op in graph['outputs']) != 0.0:
+                operators.append(op)
+
+        # A modulator and a carrier only
+        carriers = []
+        for op in operators:
+            if op in graph['outputs']:
+                carriers.append(op)
+
+        if len(carriers) != 1 or len(operators) > 2:
+            return None
+
+        carrier = carriers[0]
+        modulator = None
+        for op in graph['modulation'].get(carrier, ()):
+            if op in operators:
+                modulator = op
+
+        if modulator is None and len(operators) == 2:
+            return None
+
+        # Carrier wave table (with the output level) and the modulator wave cycle
+        oscillator = FM_Waveshape.oscillator(carrier)
+        level = FM_Waveshape.operator_output_level(carrier, 0, True)
+        wave = FM_Waveshape.waveshape(oscillator['waveshape'], None, level, oscillator['frequency'] * 100 + oscillator['freq_decimal'])
+        ring_voice = {'carrier': np.array(np.clip(wave, -FM_Waveshape_class.SAMPLE_VOLUME_f, FM_Waveshape_class.SAMPLE_VOLUME_f), dtype=np.int16), 'modulator': None, 'ratio': 0.0, 'attack': 0.0, 'sustain': 0.0}
+        if modulator is not None:
+            oscillator = FM_Waveshape.oscillator(modulator)
+            wave = FM_Waveshape.waveshape(oscillator['waveshape'], None, FM_Waveshape_class.SAMPLE_VOLUME_f, FM_Waveshape_class.OSC_FREQ_RESOLUTION)
+            depth = min(1.0, oscillator['amplitude'] / FM_Waveshape_class.OSC_LEVEL_MAX)
+            parameter = self.wave_parameter(modulator)
+            ring_voice['modulator'] = np.array(wave, dtype=np.int16)
+            ring_voice['ratio']     = oscillator['frequency'] + oscillator['freq_decimal'] / FM_Waveshape_class.OSC_FREQ_RESOLUTION
+            ring_voice['attack']    = depth * (1.0 if parameter is None else parameter['attack_factor'])
+            ring_voice['sustain']   = depth * (1.0 if parameter is None else parameter['sustain_factor'])
+
+#        print('RING VOICE:', carrier, modulator, ring_voice['ratio'], ring_voice['attack'], ring_voice['sustain'])
+        return ring_voice
+
+    # Get the ring modulation voice parameters (None: wave table voice)
+    def ring_voice(self):
+        return self._ring_voice
+
+    # Modulator level scales of the key zones (an empty list for no key zone)
+    #   scale_bytes: bytes of the wave tables of a scale, the number of the different scales is reduced in the memory budget.
+    #   The full velocity wave tables (scale 1.0) are always made, so they are counted in the budget too.
+    def key_zone_scales(self, scale_bytes=0):
+        scales = []
+        for scale in self._synth_params['SOUND']['KEY_ZONE_SCALE']:
+            scales.append(float(scale))
+
+        if scale_bytes <= 0 or len(scales) == 0:
+            return scales
+
+        # Different scales in the budget with the full velocity wave tables
+        distinct = self.distinct_scales(scales)
+        zones = SynthIO_class.WAVE_TABLE_MEMORY // scale_bytes
+        if len(distinct) + (0 if 1.0 in distinct else 1) <= zones:
+            return scales
+
+        fitted = self.fit_zone_scales(scales, zones)
+        if 1.0 not in fitted:
+            fitted = self.fit_zone_scales(scales, zones - 1)
+
+#        print('KEY ZONES:', scales, '-->', fitted)
+        return fitted
+
+    # Reduce the key zones to a number of the zones kept (an empty list for no zone)
+    #   The zones kept are spread over the keyboard, the other zones use the scale of the nearest zone kept.
+    def fit_zone_scales(self, scales, zones):
+        if zones <= 0:
+            return []
+
+        kept = []
+        for zone in list(range(zones)):
+            kept.append(len(scales) // 2 if zones == 1 else (zone * (len(scales) - 1) + (zones - 1) // 2) // (zones - 1))
+
+        fitted = []
+        for zone in list(range(len(scales))):
+            nearest = kept[0]
+            for kept_zone in kept:
+                if abs(kept_zone - zone) < abs(nearest - zone):
+                    nearest = kept_zone
+
+            fitted.append(scales[nearest])
+
+        return fitted
+
+    # Different scales in a list of the scales
+    def distinct_scales(self, scales):
+        distinct = []
+        for scale in scales:
+            if scale not in distinct:
+                distinct.append(scale)
+
+        return distinct
+
+    # Make the band-limited wave tables of the phases step by step (generator yielding after each wave table)
+    #   Returns a list of the band-limited wave tables (see FM_Waveshape.mipmap()) for the phases.
+    #   The phases sharing a wave table share the band-limited wave tables too.
+    #   previous: (wave tables, band-limited wave tables) made before, they are reused for the same wave table
+    #   All notes play the wave table itself if the free memory is not enough for its band-limited wave tables.
+    def mipmap_steps(self, wave_tables, previous=None):
+        wave_mipmaps = [None, None, None, None, None, None, None]
+        for ws in list(range(7)):
+            for shared in list(range(ws)):
+                if wave_tables[shared] is wave_tables[ws]:
+                    wave_mipmaps[ws] = wave_mipmaps[shared]
+                    break
+
+            if wave_mipmaps[ws] is None and previous is not None:
+                for shared in list(range(7)):
+                    if previous[0][shared] is wave_tables[ws]:
+                        wave_mipmaps[ws] = previous[1][shared]
+                        break
+
+            if wave_mipmaps[ws] is None:
+                if not self.memory_available(FM_Waveshape.mipmap_bytes(len(wave_tables[ws]))):
+#                    print('MIPMAP SKIPPED:', ws, gc.mem_free())
+                    wave_mipmaps[ws] = [wave_tables[ws]] * 128
+
+                else:
+                    wave_mipmaps[ws] = FM_Waveshape.mipmap(wave_tables[ws])
+
+                yield
+
+        return wave_mipmaps
+
+    # Check the free memory for new arrays of the bytes (keeping MEMORY_RESERVE)
+    def memory_available(self, new_bytes):
+        if gc.mem_free() >= new_bytes + SynthIO_class.MEMORY_RESERVE:
+            return True
+
+        gc.collect()
+        return gc.mem_free() >= new_bytes + SynthIO_class.MEMORY_RESERVE
+
+    # Start a wave shape generation job in the background (see wave_job_step())
+    #   The job running is discarded.
+    def start_wave_job(self, audio_output_level_adjust = True):
+        self._wave_job = self.generate_wave_shape_steps(audio_output_level_adjust)
+
+    # Do a step of the wave shape generation job in the background
+    #   Returns True while the job is running.
+    def wave_job_step(self):
+        if self._wave_job is None:
+            return False
+
+        try:
+            next(self._wave_job)
+            return True
+
+        except StopIteration:
+            self._wave_job = None
+
+        # A failed job must not stop the other tasks, the current wave tables are kept
+        except Exception as e:
+#            print('WAVE JOB EXCEPTION:', e)
+            self._wave_job = None
+
+        return False
+
+    # Benchmark the wave table sizes with the current sound
+    #   Prints and returns the regeneration time and the memory kept for the wave tables (with the caches) in each size.
+    def benchmark_table_sizes(self):
+        table_size = self._synth_params['SOUND']['TABLE_SIZE']
+        results = []
+        for size in FM_Waveshape_class.SAMPLE_SIZES:
+            self._synth_params['SOUND']['TABLE_SIZE'] = size
+            FM_Waveshape.sample_size(size)
+            self._wave_shape   = [None, None, None, None, None, None, None]
+            self._wave_mipmaps = [None, None, None, None, None, None, None]
+            self._layer_mipmaps = [self._wave_mipmaps]
+            self._velocity_layers = [0] * 128
+            self._zone_waves   = {}
+            gc.collect()
+            mem_free = gc.mem_free()
+            
+            start = Ticks.ms()
+            self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] == 1)
+            msec = Ticks.diff(Ticks.ms(), start)
+            gc.collect()
+            results.append({'SIZE': size, 'MSEC': msec, 'BYTES': mem_free - gc.mem_free()})
+            print('TABLE SIZE:', size, 'REGENERATION:', msec, 'msec', 'MEMORY:', results[-1]['BYTES'], 'bytes')
+
+        # Back to the sound's size
+        self._synth_params['SOUND']['TABLE_SIZE'] = table_size
+        self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] == 1)
+        return results
+
+    # Benchmark the heap allocation of a wave shape regeneration
+    #   ALLOCATED: bytes allocated during the regeneration (gc is disabled, so the garbage is counted too)
+    #   RETAINED : bytes kept after the regeneration and a garbage collection
+    def benchmark_allocations(self):
+        FM_Waveshape.invalidate_waves()
+        gc.collect()
+        mem_alloc = gc.mem_alloc()
+        gc.disable()
+        try:
+            start = Ticks.ms()
+            self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] == 1)
+            msec = Ticks.diff(Ticks.ms(), start)
+            allocated = gc.mem_alloc() - mem_alloc
+
+        finally:
+            gc.enable()
+
+        gc.collect()
+        result = {'MSEC': msec, 'ALLOCATED': allocated, 'RETAINED': gc.mem_alloc() - mem_alloc}
+        print('REGENERATION:', msec, 'msec', 'ALLOCATED:', result['ALLOCATED'], 'bytes', 'RETAINED:', result['RETAINED'], 'bytes')
+        return result
+
+    # Benchmark the FM wave generation cost of each algorithm with the sound's operators
+    #   Generates the FM waves of all phases for the algorithms 0..10 without the caches.
+    #   Prints and returns the time for each algorithm.
+    def benchmark_algorithms(self):
+        results = []
+        audio_output_level_adjust = self._synth_params['SOUND']['ADJUST_LEVEL'] == 1
+        for algorithm in list(range(11)):
+            FM_Waveshape.clear_operator_cache()
+            FM_Waveshape.invalidate_waves()
+            gc.collect()
+            start = Ticks.ms()
+            FM_Waveshape.run_steps(FM_Waveshape.fm_algorithm_steps(algorithm, audio_output_level_adjust))
+            msec = Ticks.diff(Ticks.ms(), start)
+            results.append({'ALGORITHM': algorithm, 'MSEC': msec})
+            print('ALGORITHM:', algorithm, 'GENERATION:', msec, 'msec')
+
+        # Back to the sound's algorithm
+        FM_Waveshape.clear_operator_cache()
+        self.generate_wave_shape(audio_output_level_adjust)
+        return results
+
+    # Benchmark the FM wave generation cost along the number of the operators
+    #   Generates an operator chain (1-->2-->...-->N) of the saw waves for N=1..OPERATOR_MAX without the caches.
+    #   Prints and returns the time for all phases and the time per operator for each N.
+    def benchmark_operators(self):
+        oscillators = []
+        for op in list(range(FM_Waveshape_class.OPERATOR_MAX)):
+            oscillators.append(FM_Waveshape.oscillator(op).copy())
+
+        results = []
+        phases = list(range(FM_Waveshape_class.ENVELOPE_PHASES))
+        for operators in list(range(1, FM_Waveshape_class.OPERATOR_MAX + 1)):
+            modulation = {}
+            for op in list(range(1, operators)):
+                modulation[str(op)] = [op - 1]
+
+            graph = FM_Waveshape.make_graph({'feedback': [], 'modulation': modulation, 'outputs': [operators - 1]})
+            for op in list(range(FM_Waveshape_class.OPERATOR_MAX)):
+                FM_Waveshape.oscillator(op, {'waveshape': FM_Waveshape_class.WAVE_SAW, 'frequency': op + 1, 'freq_decimal': 0, 'amplitude': 64, 'feedback': 0, 'muted': 0 if op < operators else 1})
+
+            FM_Waveshape.clear_operator_cache()
+            gc.collect()
+            start = Ticks.ms()
+            FM_Waveshape.run_steps(FM_Waveshape.fm_graph(graph, phases))
+            msec = Ticks.diff(Ticks.ms(), start)
+            results.append({'OPERATORS': operators, 'MSEC': msec, 'MSEC_PER_OPERATOR': msec / operators})
+            print('OPERATORS:', operators, 'GENERATION:', msec, 'msec', 'PER OPERATOR:', results[-1]['MSEC_PER_OPERATOR'], 'msec')
+
+        # Back to the sound's operators
+        for op in list(range(FM_Waveshape_class.OPERATOR_MAX)):
+            FM_Waveshape.oscillator(op, oscillators[op])
+
+        FM_Waveshape.clear_operator_cache()
+        self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] == 1)
+        return results
+
     # GET/SET waveshape
-    def wave_shape(self, phase=0, ws=None):
+    #   note    : MIDI note number to get the band-limited wave table for the note
+    #   velocity: note on velocity to get the wave table in the velocity layer
+    #   The wave tables are read-only, the notes play them directly (set a new table, never change it in place).
+    def wave_shape(self, phase=0, ws=None, note=None, velocity=None):
         if ws is not None:
             self._wave_shape[phase] = np.array(ws, dtype=np.int16)
+            self._wave_mipmaps[phase] = FM_Waveshape.mipmap(self._wave_shape[phase])
             
+        if note is not None and velocity is not None and self._layer_mipmaps[self._velocity_layers[velocity]][phase] is not None:
+            return self._layer_mipmaps[self._velocity_layers[velocity]][phase][note]
+
+        if note is not None and self._wave_mipmaps[phase] is not None:
+            return self._wave_mipmaps[phase][note]
+
         return self._wave_shape[phase]
 
     # Generate the Sound LFO
@@ -3013,17 +4610,16 @@ class SynthIO_class:
 
         # Update working filters
         for v in list(range(len(self.filter_storage))):
-            # No filter defined
-            if self.filter_storage[v] is None:
-                continue
-            
             # Filter not working
             if self.filter_storage[v]['TIME'] < 0:    
                 continue
             
             # All pass filter
             if   ftype == SynthIO_class.FILTER_PASS:
-                self.filter_storage[v] = {'FILTER': None, 'TIME': -1, 'START_TIME': 0, 'VELOCITY': 127}
+                self.filter_storage[v]['FILTER'] = None
+                self.filter_storage[v]['TIME'] = -1
+                self.filter_storage[v]['START_TIME'] = 0
+                self.filter_storage[v]['VELOCITY'] = 127
 
             # Redefine a filter to update along time (ADSR)
             else:
@@ -3044,49 +4640,38 @@ class SynthIO_class:
                     self.filter_storage[v]['FILTER'] = self.make_filter(ftype, note_freq + freq + delta + offset[0], reso + offset[1])
 #                    print('UPDATE FILTER:', v, freq, delta, offset, freq + delta + offset[0], reso + offset[1])
 
-    # Generate new filter / Get a filter
-    def filter(self, voice=None, velocity=127, note_number=60):
-        # Get a vacant filter number
-        if voice is None:
-            # Unison note number
-            if note_number >= 1000:
-                note_number -= 1000
-            
-            # Find a vacant filter and make it a filter for the note played
-            for flt in list(range(len(self.filter_storage))):
-                # Make a new vacant filter if not initialized
-                if self.filter_storage[flt] is None:
-                    self.filter_storage[flt] = {'FILTER': None, 'TIME': -1, 'START_TIME': 0, 'VELOCITY': 127, 'NOTE': 0, 'NOTE_FREQUENCY': 0}
-
-                # Make a filter
-                if self.filter_storage[flt]['TIME'] < 0:		# Released filter
-                    self.filter_storage[flt]['TIME'] = 0
-                    self.filter_storage[flt]['START_TIME'] = 0
-                    self.filter_storage[flt]['NOTE'] = note_number
-                    ftype = self._synth_params['FILTER']['TYPE']
-                    note_freq = synthio.midi_to_hz(note_number)
-                    self.filter_storage[flt]['NOTE_FREQUENCY'] = note_freq
-#                    print('FILTER2:', note_number, note_freq)
-                    note_freq = self.filter_storage[flt]['NOTE_FREQUENCY'] if ftype == SynthIO_class.FILTER_LPF2 or ftype == SynthIO_class.FILTER_HPF2 or ftype == SynthIO_class.FILTER_BPF2 or ftype == SynthIO_class.FILTER_NOTCH2 else 0 
-#                    print('    CUT:', note_freq)
-                    self.filter_storage[flt]['FILTER'] = self.make_filter(ftype, note_freq + self._synth_params['FILTER']['FREQUENCY'], self._synth_params['FILTER']['RESONANCE'])
-                    keys = self._synth_params['FILTER']['FILTER_KEYSENSE']
-                    if keys == 0:
-                        magni = 1.0
-                        
-                    elif keys > 0:  # 0.1 --- 1.0
-                        magni = 1.0 - keys * (128 - note_number) / 1280
-                        
-                    else:           # 1.0 --- 0.1
-                        magni = 1.0 + keys * note_number / 1280
-
-                    self.filter_storage[flt]['VELOCITY'] = int(velocity * magni)
-                    return flt
+    # Start the filter of a voice (the filter number is the voice number in MIDI_class)
+    def filter_start(self, voice, velocity=127, note_number=60):
+        self.filter_storage[voice]['TIME'] = 0
+        self.filter_storage[voice]['START_TIME'] = 0
+        self.filter_storage[voice]['NOTE'] = note_number
+        ftype = self._synth_params['FILTER']['TYPE']
+        note_freq = NoteTable.note_hz(note_number)
+        self.filter_storage[voice]['NOTE_FREQUENCY'] = note_freq
+#        print('FILTER2:', note_number, note_freq)
+
+        # Clear the filter cache when the filter has been changed
+        params = self._start_filter_params
+        if params[0] != ftype or params[1] != self._synth_params['FILTER']['FREQUENCY'] or params[2] != self._synth_params['FILTER']['RESONANCE']:
+            params[0] = ftype
+            params[1] = self._synth_params['FILTER']['FREQUENCY']
+            params[2] = self._synth_params['FILTER']['RESONANCE']
+            for nt in list(range(128)):
+                self._start_filters[nt] = None
+
+        # Make a filter for the note (the filters have no state, so the notes share them)
+        if self._start_filters[note_number] is None:
+            note_freq = self.filter_storage[voice]['NOTE_FREQUENCY'] if ftype == SynthIO_class.FILTER_LPF2 or ftype == SynthIO_class.FILTER_HPF2 or ftype == SynthIO_class.FILTER_BPF2 or ftype == SynthIO_class.FILTER_NOTCH2 else 0 
+#            print('    CUT:', note_freq)
+            self._start_filters[note_number] = self.make_filter(ftype, note_freq + self._synth_params['FILTER']['FREQUENCY'], self._synth_params['FILTER']['RESONANCE'])
+
+        self.filter_storage[voice]['FILTER'] = self._start_filters[note_number]
+        magni = NoteTable.filter_keysense(self._synth_params['FILTER']['FILTER_KEYSENSE'], note_number)
+        self.filter_storage[voice]['VELOCITY'] = int(velocity * magni)
+        return self.filter_storage[voice]
 
-            # Can't make filter (normally never comes here)
-            return -1
-        
-        # Return the filter for the voice
+    # Get the filter of a voice
+    def filter(self, voice):
 #        print('GET FILTER:', voice, self.filter_storage[voice])
         return self.filter_storage[voice]
 
@@ -3197,7 +4782,8 @@ class SynthIO_class:
         self._echo.mix      = self._synth_params['EFFECTOR']['ECHO_MIX']
 
     # Set up the synthio
-    def setup_synthio(self, wave_shape=True):
+    #   background: Generate the wave shapes in the background task (see wave_generator())
+    def setup_synthio(self, wave_shape=True, background=False):
         # Start the setup
 #        print('SETUP:', wave_shape)
         Encoder_obj.led(7, [0x00, 0xa0, 0xff])
@@ -3207,7 +4793,10 @@ class SynthIO_class:
         self.generate_sound_lfo()
         if wave_shape:
 #            print('REMAKE WAVE SHAPES.')
-            self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] ==1)
+            if background:
+                self.start_wave_job(self._synth_params['SOUND']['ADJUST_LEVEL'] ==1)
+            else:
+                self.generate_wave_shape(self._synth_params['SOUND']['ADJUST_LEVEL'] ==1)
 
         self.generate_filter_adsr()
         self.update_filters()
@@ -3327,11 +4916,17 @@ class SynthIO_class:
         # Update
         data_set[parameter] = data_value
 
+        # The additive waves need to be regenerated (the oscillators are checked in FM_Waveshape.oscillator())
+        if category == 'ADDITIVEWAVE':
+            FM_Waveshape.invalidate_waves(False, True)
+
         return data_value
 
     # Load parameter file
+    #   The current sound is kept if the file is not loaded or the wave shapes are not made (e.g. no memory).
     def load_parameter_file(self, bank, sound):
         success = True
+        synth_params = self._synth_params
         try:
             with open('/sd/SYNTH/SOUND/BANK' + str(bank) + '/PFMS{:03d}'.format(sound) + '.json', 'r') as f:
                 file_data = json.load(f)
@@ -3340,6 +4935,7 @@ class SynthIO_class:
             
             # Overwrite parameters loaded
             self._init_parameters()
+            FM_Waveshape.invalidate_waves(False, True)
 #            print('DATA KEYS:', file_data.keys())
             for category in file_data.keys():
                 if category == 'OSCILLATORS':
@@ -3369,8 +4965,11 @@ class SynthIO_class:
 
             # Set up the synthesizer
             Encoder_obj.i2c_lock()
-            self.setup_synthio()
-            Encoder_obj.i2c_unlock()
+            try:
+                self.setup_synthio()
+
+            finally:
+                Encoder_obj.i2c_unlock()
 
             # The latest sound file
             with open('/sd/SYNTH/SYSTEM/latest_sound.json', 'w') as f:
@@ -3380,9 +4979,30 @@ class SynthIO_class:
         except Exception as e:
 #            print('SD LOAD EXCEPTION:', e)
             success = False
+
+            # Restore the current sound (the wave shapes are swapped only after they are made)
+            if self._synth_params is not synth_params:
+                self._synth_params = synth_params
+                self.restore_sound()
         
         return success
 
+    # Restore the synthesizer to the current parameters without remaking the wave shapes
+    def restore_sound(self):
+        dataset = self.synthio_parameter('SAMPLING')
+        FM_Waveshape.sampling_file(0, dataset['WAVE1'])
+        FM_Waveshape.sampling_file(1, dataset['WAVE2'])
+        FM_Waveshape.sampling_file(2, dataset['WAVE3'])
+        FM_Waveshape.sampling_file(3, dataset['WAVE4'])
+        FM_Waveshape.sample_size(self._synth_params['SOUND']['TABLE_SIZE'])
+        FM_Waveshape.invalidate_waves()
+        try:
+            self.setup_synthio(False)
+
+        except Exception as e:
+#            print('RESTORE EXCEPTION:', e)
+            pass
+
     # Save parameter file
     def save_parameter_file(self, bank, sound):
         try:
@@ -3977,7 +5597,7 @@ class Application_class:
         # Oscillator parameter has been edited
         if   Application_class.EDITED_OSCILLATOR is not None:
 #            print('SET SYNTH OSC.')
-            SynthIO.setup_synthio(True)
+            SynthIO.setup_synthio(True, True)
             
         # Edited aother parameter
         elif Application_class.EDITED_PARAMETER is not None:
@@ -4103,6 +5723,10 @@ class Application_class:
                 f.close()
                 
                 if algorithm >= 0 and algorithm < len(file_data):
+                    # User algorithm
+                    if isinstance(file_data[algorithm], dict):
+                        return file_data[algorithm]['chart']
+                    
                     return file_data[algorithm]
 
         except:
@@ -4253,10 +5877,11 @@ class Application_class:
             
         if SynthIO is not None:
             waveshape = SynthIO.wave_shape() if wave_table is None else wave_table
-            tm = -1
-            for amp in waveshape:
-                tm += 1
-                x = int(tm * w / FM_Waveshape_class.SAMPLE_SIZE)
+            size = len(waveshape)
+            step = max(1, size // 512)
+            for tm in list(range(0, size, step)):
+                amp = waveshape[tm]
+                x = int(tm * w / size)
 #                y = int(amp * h / max_amp) + cy
                 y = cy - int(amp * h / max_amp)
                 if tm == 0:
@@ -4607,7 +6232,7 @@ class Application_class:
                                             Encoder_obj.i2c_unlock()
                                             
 #                                            ADC_Mic.sampling(dataset['TIME'] / 100000, dataset['AVRG'])
-                                            ADC_Mic.sampling(dataset['TIME'], dataset['AVRG'])
+                                            ADC_Mic.sampling(dataset['TIME'], dataset['AVRG'], FM_Waveshape_class.SAMPLE_SIZE)
 #                                            print('SAMPLES=', len(ADC_MIC_class.SAMPLED_WAVE))
                                             self.show_OLED_waveshape(ADC_MIC_class.SAMPLED_WAVE)
                                             time.sleep(2.0)
@@ -4675,8 +6300,12 @@ if __name__=='__main__':
     # Create an Application object
     Application = Application_class()
  
+    # Create the note lookup tables
+    NoteTable = NoteTable_class()
+
     # Create a FM waveshape generator object
     FM_Waveshape = FM_Waveshape_class()
+    FM_Waveshape.load_algorithms()
 
     # Create a Synthio object
     SynthIO = SynthIO_class()